@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+#
+# Capture pipeline benchmark suite on synthetic JPEG streams: sustained fps,
+# per-frame latency percentiles, CPU per frame and peak RSS of the reader,
+# the decode factory and the full pipeline with CapSubscriber and
+# ScreenRecorder, over resolutions, pool sizes and subscriber counts.
+# Every scenario runs in a fresh process so peak RSS is its own.
+#
+# usage: python benchmarks/bench_capture.py                      # run, compare with the baseline
+#        python benchmarks/bench_capture.py --save-baseline      # run, record the baseline
+#        python benchmarks/bench_capture.py --quick -k 1080p     # subset
+#
+# Exits with status 1 when a scenario crashed, a metric regressed by more
+# than --threshold or a baseline scenario that was run has no result.
+
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # windows, no peak RSS
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_jpeg_splitter import FakeSocket, make_frames
+from core.captrue import ReplayObserver, CapSubscriber, ScreenRecorder, TapeWriter, PreviewJpeg
+from core.captrue._cap_frame import CapTask
+from core.captrue._cap_observer import _capture_reader, _captrue_factory
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+RESOLUTIONS = {"720p": (720, 1280), "1080p": (1080, 2340), "1440p": (1440, 3200)}
+CHUNK_SIZE = 64 * 1024
+
+# gated metrics, True if higher is better; p99 is reported but too noisy on short runs to gate on
+METRICS = {
+    "fps": True,
+    "latency_p50_ms": False,
+    "latency_p90_ms": False,
+    "cpu_ms_per_frame": False,
+    "peak_rss_mb": False,
+}
+
+
+def scenarios(quick: bool = False):
+    """Scenario id -> parameters."""
+    result = {}
+    pools = (1, 2) if quick else (1, 2, 4)
+    fanout = (1, 4) if quick else (1, 4, 16)
+    for res in RESOLUTIONS:
+        result[f"reader/{res}"] = {"kind": "reader", "res": res}
+        result[f"factory/{res}"] = {"kind": "factory", "res": res}
+        for workers in pools:
+            result[f"subscriber/{res}/w{workers}/s1"] = {"kind": "subscriber", "res": res,
+                                                          "workers": workers, "subscribers": 1}
+        for subscribers in fanout[1:]:
+            result[f"subscriber/{res}/w2/s{subscribers}"] = {"kind": "subscriber", "res": res,
+                                                              "workers": 2, "subscribers": subscribers}
+        result[f"recorder/{res}/w2"] = {"kind": "recorder", "res": res, "workers": 2}
+    return result
+
+
+def stream(res: str, frames: int):
+    distinct = make_frames(*RESOLUTIONS[res], 16, False)
+    return [distinct[i % len(distinct)] for i in range(frames)]
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process and its finished children (the decode workers)."""
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_rss_mb():
+    """Peak RSS of this process or of its largest child, in MiB."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # bytes on macOS, KiB elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Window:
+    """Wall clock and CPU seconds of the measured part of a runner, inputs are built before it."""
+
+    def __enter__(self):
+        self.elapsed = time.perf_counter()
+        self.cpu = cpu_seconds()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.elapsed = time.perf_counter() - self.elapsed
+        self.cpu = cpu_seconds() - self.cpu
+
+
+def run_reader(params, frames):
+    data = b"".join(stream(params["res"], frames))
+    thiz = types.SimpleNamespace(sock=FakeSocket(data, CHUNK_SIZE), stop_event=threading.Event(),
+                                 profiler=None)
+    samples = []
+    count = 0
+    with Window() as window:
+        last = time.perf_counter()
+        for _ in _capture_reader(thiz):
+            now = time.perf_counter()
+            samples.append(now - last)
+            last = now
+            count += 1
+    return count, samples, window
+
+
+def run_factory(params, frames):
+    jpegs = stream(params["res"], frames)
+    products = frozenset((PreviewJpeg(),))
+    samples = []
+    with Window() as window:
+        for seq, jpeg in enumerate(jpegs):
+            start = time.perf_counter()
+            _captrue_factory(CapTask(seq, time.time(), jpeg, products))
+            samples.append(time.perf_counter() - start)
+    return len(jpegs), samples, window
+
+
+class _Counter(CapSubscriber):
+    def on_capture(self, frame):
+        # detach like a real reader would
+        if self.product in frame:
+            frame.detach(self.product)
+
+
+def run_pipeline(params, frames):
+    path = os.path.join(tempfile.mkdtemp(), "bench.tape")
+    with TapeWriter(path) as tape:
+        for i, jpeg in enumerate(stream(params["res"], frames)):
+            for offset in range(0, len(jpeg), CHUNK_SIZE):
+                tape.write(jpeg[offset:offset + CHUNK_SIZE], arrival=i / 60)
+
+    samples = []
+    hook = lambda seq, stamps: samples.append(max(stamps.values()) - stamps["recv"])
+    observer = ReplayObserver(path, realtime=False, workers=params["workers"], dedup=False, profile_hook=hook)
+    recorder = None
+    if params["kind"] == "recorder":
+        recorder = ScreenRecorder(os.path.join(os.path.dirname(path), "bench.mp4"))
+        observer.subscribe(recorder)
+        recorder.start()
+    for _ in range(params.get("subscribers", 1)):
+        observer.subscribe(_Counter(PreviewJpeg()))
+    # stopping is in the window, the decode workers count once they exited
+    with Window() as window:
+        observer.start()
+        observer.wait()
+        if recorder is not None:
+            # deliver the mailbox, then flush the encoder process
+            observer.unsubscribe(recorder)
+            recorder.stop()
+        observer.stop()
+    os.remove(path)
+    return len(samples), samples, window
+
+
+RUNNERS = {"reader": run_reader, "factory": run_factory, "subscriber": run_pipeline, "recorder": run_pipeline}
+
+
+def run_scenario(scenario_id: str, frames: int):
+    params = scenarios()[scenario_id]
+    cv2.setNumThreads(1)
+    count, samples, window = RUNNERS[params["kind"]](params, frames)
+    latency = np.array(samples or [0.0]) * 1000
+    return {
+        "frames": count,
+        "fps": count / window.elapsed,
+        "latency_p50_ms": float(np.percentile(latency, 50)),
+        "latency_p90_ms": float(np.percentile(latency, 90)),
+        "latency_p99_ms": float(np.percentile(latency, 99)),
+        "cpu_ms_per_frame": window.cpu / max(count, 1) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def machine():
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold: float, selected=()):
+    """Print the change of every metric, return the regressions.
+
+    A baseline scenario in `selected` without a result counts as a regression.
+    """
+    regressions = []
+    for scenario_id in selected:
+        if scenario_id in baseline and scenario_id not in results:
+            print(f"REGRESSION {scenario_id}: in the baseline but no result")
+            regressions.append((scenario_id, None, None, None, None))
+    for scenario_id, metrics in results.items():
+        base = baseline.get(scenario_id)
+        if base is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            new, old = metrics.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            if worse > threshold:
+                regressions.append((scenario_id, metric, old, new, change))
+    for scenario_id, metric, old, new, change in regressions:
+        if metric is None:
+            continue
+        print(f"REGRESSION {scenario_id} {metric}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--quick", action="store_true", help="fewer pool sizes and subscriber counts")
+    parser.add_argument("-k", dest="match", default=None, help="only scenarios containing this text")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_scenario(args.run, args.frames)))
+        return
+
+    results = {}
+    selected = [scenario_id for scenario_id in scenarios(args.quick)
+                if not args.match or args.match in scenario_id]
+    failed = []
+    for scenario_id in selected:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", scenario_id,
+                                 "--frames", str(args.frames)], capture_output=True, text=True)
+        if output.returncode != 0:
+            print(f"{scenario_id} failed:\n{output.stderr}")
+            failed.append(scenario_id)
+            continue
+        results[scenario_id] = metrics = json.loads(output.stdout.strip().splitlines()[-1])
+        rss = f"{metrics['peak_rss_mb']:.0f}" if metrics["peak_rss_mb"] is not None else "-"
+        print(f"{scenario_id:<28} {metrics['fps']:>8.1f} fps  p50 {metrics['latency_p50_ms']:>7.1f} ms  "
+              f"p99 {metrics['latency_p99_ms']:>7.1f} ms  cpu {metrics['cpu_ms_per_frame']:>6.1f} ms/frame  "
+              f"rss {rss:>5} MB")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != machine():
+            print(f"baseline was recorded on {baseline.get('machine')}, numbers may not be comparable")
+        regressions = compare(results, baseline["scenarios"], args.threshold, selected)
+        print(f"{len(regressions)} regressions over {args.threshold:.0%} against {args.baseline}")
+
+    if args.save_baseline:
+        scenarios_saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                scenarios_saved = json.load(f).get("scenarios", {})
+        scenarios_saved.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"machine": machine(), "frames": args.frames, "scenarios": scenarios_saved}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+
+    if failed:
+        print(f"{len(failed)} scenarios failed: {', '.join(failed)}")
+    sys.exit(1 if regressions or failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+#
+# Throughput of the capture stream frame splitter, the legacy
+# find/slice implementation vs JpegSplitter.
+#
+# usage: python benchmarks/bench_jpeg_splitter.py [--width 1080] [--height 2340] [--frames 300]
+
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.captrue._jpeg_splitter import JpegSplitter
+
+
+class FakeSocket:
+    """Replay a byte stream in fixed size chunks, like the hdc forwarded socket."""
+
+    def __init__(self, data: bytes, chunk_size: int):
+        self._data = memoryview(data)
+        self._offset = 0
+        self._chunk_size = chunk_size
+
+    def recv(self, size: int) -> bytes:
+        size = min(size, self._chunk_size)
+        chunk = self._data[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        return bytes(chunk)
+
+    def recv_into(self, view) -> int:
+        size = min(len(view), self._chunk_size, len(self._data) - self._offset)
+        view[:size] = self._data[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+
+def legacy_reader(sock):
+    """The find/slice loop _capture_reader used before JpegSplitter."""
+    start_flag = b'\xff\xd8'
+    end_flag = b'\xff\xd9'
+    buffer = bytearray()
+    while True:
+        chunk = sock.recv(4096 * 1024)
+        if not chunk:
+            break
+        buffer += chunk
+        start_idx = buffer.find(start_flag)
+        end_idx = buffer.find(end_flag)
+        while start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+            jpeg_image = buffer[start_idx:end_idx + 2]
+            buffer = buffer[end_idx + 2:]
+            start_idx = buffer.find(start_flag)
+            end_idx = buffer.find(end_flag)
+            yield jpeg_image
+
+
+def splitter_reader(sock):
+    splitter = JpegSplitter()
+    while splitter.recv_into(sock):
+        for frame in splitter.frames():
+            yield bytes(frame)
+
+
+def make_frames(width: int, height: int, count: int, thumbnail: bool):
+    """Encode `count` distinct synthetic screens, optionally with an EXIF-like thumbnail."""
+    rng = np.random.default_rng(0)
+    base = np.zeros((height, width, 3), np.uint8)
+    cv2.rectangle(base, (0, 0), (width, height // 12), (40, 40, 200), -1)
+    frames = []
+    for i in range(count):
+        img = base.copy()
+        y = (i * 37) % (height - 200)
+        img[y:y + 200] = rng.integers(0, 255, (200, width, 3), np.uint8)
+        cv2.putText(img, f"frame {i}", (50, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 3, (255, 255, 255), 5)
+        _, jpeg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+        jpeg = jpeg.tobytes()
+        if thumbnail:
+            _, thumb = cv2.imencode('.jpg', cv2.resize(img, (64, 128)))
+            payload = b'Exif\x00\x00' + thumb.tobytes()
+            app1 = b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+            jpeg = jpeg[:2] + app1 + jpeg[2:]
+        frames.append(jpeg)
+    return frames
+
+
+def run(name, reader, stream: bytes, chunk_size: int, expected):
+    start = time.perf_counter()
+    count = 0
+    intact = 0
+    for frame in reader(FakeSocket(stream, chunk_size)):
+        if count < len(expected) and frame == expected[count]:
+            intact += 1
+        count += 1
+    elapsed = time.perf_counter() - start
+    mbps = len(stream) / elapsed / 1024 / 1024
+    print(f"{name:<10} {count:>6} frames {intact:>6} intact {elapsed * 1000:>9.1f} ms "
+          f"{count / elapsed:>9.1f} fps {mbps:>9.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=2340)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--chunk", type=int, default=64 * 1024, help="bytes per recv")
+    args = parser.parse_args()
+
+    for thumbnail in (False, True):
+        distinct = make_frames(args.width, args.height, 16, thumbnail)
+        expected = [distinct[i % len(distinct)] for i in range(args.frames)]
+        stream = b''.join(expected)
+        print(f"\n{args.width}x{args.height}, {len(stream) / len(expected) / 1024:.0f} KiB/frame, "
+              f"{args.chunk // 1024} KiB chunks, thumbnail={thumbnail}")
+        run("legacy", legacy_reader, stream, args.chunk, expected)
+        run("splitter", splitter_reader, stream, args.chunk, expected)
+
+
+if __name__ == "__main__":
+    main()
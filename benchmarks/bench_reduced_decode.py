@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+#
+# Preview path throughput: full decode + INTER_AREA resize vs libjpeg
+# reduced decode (IMREAD_REDUCED_*) + remaining resize, single core.
+#
+# usage: python benchmarks/bench_reduced_decode.py [--frames 100]
+
+import os
+import sys
+import time
+import argparse
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_jpeg_splitter import make_frames
+from core.captrue._jpeg_decode import ScaledDecoder
+
+RESOLUTIONS = ((720, 1280), (1080, 2340), (1440, 3200))
+SCALES = (0.3, 0.5, 0.25)
+
+
+def preview(jpeg_image, scale: float, quality: int, reduced: bool):
+    image = ScaledDecoder(jpeg_image, scale, reduced=reduced).get(scale)
+    _, encoded = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return encoded
+
+
+def measure(frames, scale: float, reduced: bool) -> float:
+    start = time.process_time()
+    for jpeg_image in frames:
+        preview(jpeg_image, scale, 50, reduced)
+    return len(frames) / (time.process_time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    # frames/sec per core: one thread for OpenCV, CPU time instead of wall time
+    cv2.setNumThreads(1)
+    print(f"{'resolution':<12} {'scale':>5} {'factor':>6} {'full fps/core':>14} {'reduced fps/core':>17} {'speedup':>8}")
+    for width, height in RESOLUTIONS:
+        distinct = make_frames(width, height, 8, False)
+        frames = [distinct[i % len(distinct)] for i in range(args.frames)]
+        for scale in SCALES:
+            full = measure(frames, scale, reduced=False)
+            reduced = measure(frames, scale, reduced=True)
+            factor = ScaledDecoder(frames[0], scale).factor
+            print(f"{width}x{height:<7} {scale:>5} {'1/' + str(factor):>6} {full:>14.1f} {reduced:>17.1f} {reduced / full:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+#
+# Replay a capture tape through the full CapObserver pipeline, no device
+# needed. Record a tape with `python example.py -s <serial> --record-stream
+# session.tape`, or synthesize one with --synthesize.
+#
+# usage: python benchmarks/bench_replay.py session.tape [--realtime] [--rendition preview]
+#        python benchmarks/bench_replay.py session.tape --synthesize [--width 1080] [--height 2340]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_jpeg_splitter import make_frames
+from core.captrue import ReplayObserver, CapSubscriber, TapeWriter, DEFAULT_RENDITIONS
+
+
+def synthesize(path: str, width: int, height: int, frames: int, fps: float, chunk_size: int = 64 * 1024):
+    """Write a tape of `frames` synthetic screens arriving at `fps`, split in socket sized chunks."""
+    distinct = make_frames(width, height, 16, False)
+    with TapeWriter(path) as tape:
+        for i in range(frames):
+            jpeg = distinct[i % len(distinct)]
+            for offset in range(0, len(jpeg), chunk_size):
+                tape.write(jpeg[offset:offset + chunk_size], arrival=i / fps)
+    print(f"wrote {frames} frames {width}x{height} @ {fps} fps to {path}")
+
+
+class CountingSubscriber(CapSubscriber):
+    def __init__(self, product):
+        super().__init__(product)
+        self.frames = 0
+
+    def on_capture(self, frame):
+        if self.product in frame:
+            self.frames += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tape")
+    parser.add_argument("--synthesize", action="store_true", help="write a synthetic tape first")
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=2340)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--realtime", action="store_true", help="replay at the recorded pace")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--loops", type=int, default=1)
+    parser.add_argument("--rendition", default="preview", choices=sorted(DEFAULT_RENDITIONS))
+    parser.add_argument("--subscribers", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.tape, args.width, args.height, args.frames, args.fps)
+
+    observer = ReplayObserver(args.tape, realtime=args.realtime, speed=args.speed, loops=args.loops,
+                              workers=args.workers, profile=True)
+    product = observer.rendition(args.rendition)
+    subscribers = [CountingSubscriber(product) for _ in range(args.subscribers)]
+    for subscriber in subscribers:
+        observer.subscribe(subscriber)
+
+    start = time.perf_counter()
+    cpu = time.process_time()
+    observer.start()
+    observer.wait()
+    elapsed = time.perf_counter() - start
+    stats = observer.stats()
+    observer.stop()
+
+    for hist in stats["latency"].values():
+        hist.pop("buckets")
+    print(json.dumps({
+        "rendition": args.rendition,
+        "realtime": args.realtime,
+        "elapsed": elapsed,
+        "delivered": [s.frames for s in subscribers],
+        "parent_cpu_per_frame_ms": (time.process_time() - cpu) / max(stats["frames"], 1) * 1000,
+        **stats,
+        "fps": stats["frames"] / elapsed,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,22 @@
 from ._screenrecorder import ScreenRecorder
 from ._cap_observer import CapObserver
 from ._cap_subscriber import CapSubscriber
+from ._cap_frame import CapFrame, FrameProduct, RawJpeg, DecodedBgr, PreviewJpeg, RAW_JPEG
+from ._cap_frame import DEFAULT_RENDITIONS, DEFAULT_RENDITION
+from ._adaptive import AdaptiveController, rendition_ladder
+from ._cap_profiler import CapProfiler
+from ._mailbox import DeliveryPolicy
+from ._mjpeg_avi import MjpegAviWriter, transcode, transcode_in_background
+from ._recording_index import RecordingIndex, TimestampWriter
+from ._instant_replay import InstantReplay
+from ._recording_encoder import RecordingEncoder, VideoSink, OverflowPolicy
+from ._cap_replay import ReplayObserver
+from ._stream_tape import TapeWriter, read_tape
 
-__all__ = ["ScreenRecorder", "CapObserver", "CapSubscriber"]
\ No newline at end of file
+__all__ = ["ScreenRecorder", "CapObserver", "CapSubscriber",
+           "CapFrame", "FrameProduct", "RawJpeg", "DecodedBgr", "PreviewJpeg", "RAW_JPEG",
+           "DEFAULT_RENDITIONS", "DEFAULT_RENDITION", "AdaptiveController", "rendition_ladder",
+           "CapProfiler", "ReplayObserver", "TapeWriter", "read_tape",
+           "DeliveryPolicy", "MjpegAviWriter", "transcode", "transcode_in_background",
+           "RecordingIndex", "TimestampWriter", "InstantReplay",
+           "RecordingEncoder", "VideoSink", "OverflowPolicy"]
\ No newline at end of file
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import time
+import typing
+
+from ._cap_frame import FrameProduct, RawJpeg
+
+
+def rendition_ladder(renditions: typing.Dict[str, FrameProduct]) -> typing.List[str]:
+    """Order rendition names from the best to the cheapest, leaving out the raw stream."""
+    ladder = [name for name, product in renditions.items() if not isinstance(product, RawJpeg)]
+    return sorted(ladder, key=lambda name: (renditions[name].scale, renditions[name].quality), reverse=True)
+
+
+class AdaptiveController:
+    """Pick rendition and frame interval of one viewer from its flush latency.
+
+    When a flush takes longer than `target_latency` or too many bytes wait
+    to be flushed, the viewer falls behind: the controller first steps down
+    the rendition ladder (lower scale and quality), then stretches the frame
+    interval. After `recover_after` fast flushes in a row it shortens the
+    interval again and then steps back up the ladder. Changes are at least
+    `cooldown` seconds apart so one slow flush does not cause oscillation.
+
+    Example:
+        controller = AdaptiveController(["full", "half", "preview", "quarter"])
+        started = controller.on_write(len(frame))
+        yield self.flush()
+        controller.on_flush(started)
+        yield tornado.gen.sleep(controller.interval)
+    """
+
+    def __init__(self, ladder: typing.List[str], start: str = None,
+                 min_interval: float = 0.033, max_interval: float = 0.5,
+                 target_latency: float = 0.1, max_bytes_in_flight: int = 512 * 1024,
+                 recover_after: int = 10, cooldown: float = 1.0):
+        """
+        Args:
+            ladder (List[str]): rendition names allowed for the viewer, best first.
+            start (str, optional): initial rendition. Default is the middle of the ladder.
+            min_interval (float, optional): shortest frame interval in seconds. Default is 0.033.
+            max_interval (float, optional): longest frame interval in seconds. Default is 0.5.
+            target_latency (float, optional): flush latency in seconds considered healthy. Default is 0.1.
+            max_bytes_in_flight (int, optional): unflushed bytes considered too many. Default is 512 KiB.
+            recover_after (int, optional): fast flushes in a row before upgrading. Default is 10.
+            cooldown (float, optional): minimum seconds between two changes. Default is 1.0.
+        """
+        if not ladder:
+            raise ValueError("ladder must not be empty")
+        self.ladder = list(ladder)
+        self.level = self.ladder.index(start) if start in self.ladder else len(self.ladder) // 2
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.target_latency = target_latency
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.recover_after = recover_after
+        self.cooldown = cooldown
+
+        self.latency = 0.0           # smoothed flush latency
+        self.bytes_in_flight = 0
+        self._fast_flushes = 0
+        self._last_change = 0.0
+
+    @property
+    def rendition(self) -> str:
+        return self.ladder[self.level]
+
+    def on_write(self, nbytes: int) -> typing.Tuple[float, int]:
+        """Record a frame written to the viewer, pass the result to `on_flush`."""
+        self.bytes_in_flight += nbytes
+        return time.monotonic(), nbytes
+
+    def on_flush(self, started: typing.Tuple[float, int]):
+        """Record a completed flush and adapt rendition and interval."""
+        now = time.monotonic()
+        start, nbytes = started
+        latency = now - start
+        self.latency = latency if self.latency == 0 else self.latency * 0.7 + latency * 0.3
+        behind = self.latency > self.target_latency or self.bytes_in_flight > self.max_bytes_in_flight
+        self.bytes_in_flight = max(0, self.bytes_in_flight - nbytes)
+
+        if behind:
+            self._fast_flushes = 0
+            if now - self._last_change >= self.cooldown:
+                self._degrade()
+                self._last_change = now
+        elif self.latency < self.target_latency / 2:
+            self._fast_flushes += 1
+            if self._fast_flushes >= self.recover_after and now - self._last_change >= self.cooldown:
+                self._fast_flushes = 0
+                self._upgrade()
+                self._last_change = now
+
+    def _degrade(self):
+        if self.level < len(self.ladder) - 1:
+            self.level += 1
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+
+    def _upgrade(self):
+        if self.interval > self.min_interval:
+            self.interval = max(self.min_interval, self.interval / 1.5)
+        elif self.level > 0:
+            self.level -= 1
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import typing
+import threading
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True)
+class RawJpeg:
+    """The JPEG frame exactly as sent by the device."""
+
+
+@dataclass(frozen=True)
+class DecodedBgr:
+    """The decoded BGR ndarray, resized by `scale`."""
+    scale: float = 1.0
+
+
+@dataclass(frozen=True)
+class PreviewJpeg:
+    """A re-encoded JPEG resized by `scale` with the given `quality`."""
+    scale: float = 0.3
+    quality: int = 50
+
+
+FrameProduct = typing.Union[RawJpeg, DecodedBgr, PreviewJpeg]
+
+RAW_JPEG = RawJpeg()
+
+# Named preview renditions, all of them are computed from one decode per frame.
+DEFAULT_RENDITIONS: typing.Dict[str, FrameProduct] = {
+    "raw": RAW_JPEG,
+    "full": PreviewJpeg(1.0, 80),
+    "half": PreviewJpeg(0.5, 70),
+    "preview": PreviewJpeg(0.3, 50),
+    "quarter": PreviewJpeg(0.25, 40),
+}
+DEFAULT_RENDITION = "preview"
+
+
+def needs_decode(products: typing.Iterable[FrameProduct]) -> bool:
+    """Check if any of the products can only be built from a decoded frame."""
+    return any(not isinstance(p, RawJpeg) for p in products)
+
+
+class CapTask(typing.NamedTuple):
+    """One captured frame on its way to the decode workers."""
+    seq: int
+    timestamp: float
+    jpeg_image: bytes
+    products: typing.FrozenSet[FrameProduct]
+    slot: typing.Any = None          # SlotRef the outputs may be written into
+    stamps: typing.Optional[typing.Dict[str, float]] = None  # profiling timestamps
+
+
+@dataclass
+class CapFrame:
+    """One captured frame and the products computed for it.
+
+    Example:
+        frame[RAW_JPEG]        # bytes
+        frame[DecodedBgr()]    # np.ndarray
+        frame[PreviewJpeg()]   # np.ndarray (encoded)
+    """
+    seq: int
+    timestamp: float
+    products: typing.Dict[FrameProduct, typing.Any] = field(default_factory=dict)
+    stamps: typing.Dict[str, float] = field(default_factory=dict)
+    _shared: typing.FrozenSet[FrameProduct] = field(default=frozenset(), repr=False)
+    _release_hook: typing.Optional[typing.Callable] = field(default=None, repr=False)
+    _refs: int = field(default=0, repr=False)
+    _lock: typing.Optional[threading.Lock] = field(default=None, repr=False)
+
+    def __getitem__(self, product: FrameProduct):
+        return self.products[product]
+
+    def __contains__(self, product: FrameProduct) -> bool:
+        return product in self.products
+
+    def get(self, product: FrameProduct, default=None):
+        return self.products.get(product, default)
+
+    @property
+    def shared(self) -> bool:
+        """True if some products are views of a shared memory slot."""
+        return self._release_hook is not None
+
+    def set_release_hook(self, hook: typing.Callable, products: typing.Iterable[FrameProduct]):
+        """Mark `products` as shared memory views and call `hook` once the frame is released."""
+        self._shared = frozenset(products)
+        self._release_hook = hook
+        self._lock = threading.Lock()
+
+    def detach(self, product: FrameProduct):
+        """Get a product that stays valid after the frame is released.
+
+        Shared memory views are copied, other products are returned as-is.
+        """
+        value = self.products[product]
+        return value.copy() if product in self._shared else value
+
+    def retain(self) -> 'CapFrame':
+        """Keep the shared memory of the frame alive until the matching `release`."""
+        if self._release_hook is not None:
+            with self._lock:
+                self._refs += 1
+        return self
+
+    def release(self):
+        """Release one reference, the shared products are gone after the last one."""
+        if self._release_hook is None:
+            return
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            hook, self._release_hook = self._release_hook, None
+        for product in self._shared:
+            # the slot is about to be reused
+            self.products.pop(product, None)
+        hook()
@@ -4,69 +4,147 @@
 # require: python >= 3.8
 
 import cv2
+import time
 import typing
+import socket
 import threading
 
 from logzero import logger
 from datetime import datetime
 import numpy as np
-from multiprocessing.pool import Pool
 
 from core.hmdriver2 import ScreenCaptureError
 from core.hmdriver2 import HmDriver
 from ._cap_subscriber import CapSubscriber
+from ._jpeg_splitter import JpegSplitter, jpeg_size
+from ._jpeg_decode import ScaledDecoder
+from ._frame_pool import FramePool, default_workers
+from ._frame_dedup import FrameDeduplicator
+from ._stream_tape import StreamTap
+from ._cap_profiler import CapProfiler, STAGE_RECV, STAGE_SPLIT, STAGE_DECODE, STAGE_ENCODE, STAGE_FANOUT
+from ._mailbox import Mailbox, DeliveryPolicy
+from ._shm_frames import SharedFrameSlots, SlotRef, SlotWriter, estimate_slot_size
+from ._cap_frame import CapFrame, CapTask, FrameProduct, RawJpeg, DecodedBgr, PreviewJpeg, needs_decode
+from ._cap_frame import DEFAULT_RENDITIONS
 
 
 def _capture_reader(thiz):
     """Capture screen frames and save current frames."""
 
-    # JPEG start and end markers.
-    start_flag = b'\xff\xd8'
-    end_flag = b'\xff\xd9'
-    buffer = bytearray()
+    splitter = JpegSplitter()
     while not thiz.stop_event.is_set():
         try:
-            buffer += thiz._recv_msg(4096 * 1024, decode=False, print=False)
+            nbytes = splitter.recv_into(thiz.sock)
+            if nbytes == 0:
+                logger.warning("capture stream closed by device")
+                break
+            if thiz.profiler is not None:
+                thiz._recv_time = time.time()
+                thiz.profiler.count_bytes(nbytes, thiz._recv_time)
+        except socket.timeout:
+            continue
         except Exception as e:
-            print(f"Error receiving data: {e}")
+            logger.error(f"Error receiving data: {e}")
             break
 
-        start_idx = buffer.find(start_flag)
-        end_idx = buffer.find(end_flag)
-        while start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            # Extract one JPEG image
-            jpeg_image: bytearray = buffer[start_idx:end_idx + 2]
-            buffer = buffer[end_idx + 2:]
-            # Search for the next JPEG image in the buffer
-            start_idx = buffer.find(start_flag)
-            end_idx = buffer.find(end_flag)
-            yield jpeg_image
+        for jpeg_image in splitter.frames():
+            # the view is only valid until the next recv_into
+            yield bytes(jpeg_image)
             
     logger.debug("_capture_reader exit")
     
-def _captrue_factory(jpeg_image):
-    """decode and resize jpeg image"""
+def _captrue_factory(task):
+    """Compute the requested products of one jpeg image.
+
+    Args:
+        task (CapTask): the frame, ndarray outputs are written into the shared
+            memory `task.slot` if one is given.
+
+    Returns:
+        CapFrame: the frame with one entry per product, None on decode errors.
+    """
+    jpeg_image, products, slot = task.jpeg_image, task.products, task.slot
+    frame = CapFrame(task.seq, task.timestamp)
     try:
-        # Decode the JPEG image
-        frame_tmp = cv2.imdecode(np.frombuffer(jpeg_image, np.uint8), cv2.IMREAD_COLOR)
-        # Resize the image to 40% of its original size
-        frame_decoded = cv2.resize(frame_tmp, (0, 0), fx=0.3, fy=0.3, interpolation=cv2.INTER_AREA)
-        # Set the JPEG compression quality to 70%
-        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 50]
-        _, frame_encoded = cv2.imencode('.jpg', frame_decoded, encode_params)
-        # Return the decoded and encoded frames
-        return (frame_decoded, frame_encoded)
+        # one decode shared by all products, at the lowest resolution they allow
+        scales = [p.scale for p in products if isinstance(p, (DecodedBgr, PreviewJpeg))]
+        decoder = ScaledDecoder(jpeg_image, max(scales)) if scales else None
+
+        for product in products:
+            if isinstance(product, RawJpeg):
+                frame.products[product] = jpeg_image
+            elif isinstance(product, DecodedBgr):
+                frame.products[product] = decoder.get(product.scale)
+            elif isinstance(product, PreviewJpeg):
+                encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), product.quality]
+                _, frame.products[product] = cv2.imencode('.jpg', decoder.get(product.scale), encode_params)
+
+        if task.stamps is not None:
+            frame.stamps.update(task.stamps)
+            if decoder is not None and decoder.decoded_at is not None:
+                frame.stamps[STAGE_DECODE] = decoder.decoded_at
+            if any(isinstance(p, PreviewJpeg) for p in products):
+                frame.stamps[STAGE_ENCODE] = time.time()
+
+        if slot is not None:
+            # only small descriptors go back through the pipe
+            writer = SlotWriter(slot)
+            for product, value in frame.products.items():
+                if isinstance(value, np.ndarray):
+                    frame.products[product] = writer.describe(value)
+        return frame
     except Exception as e:
         logger.error(f"Error decoding jpeg image: {e}")
         return None
-    
+
 
 class CapObserver(HmDriver):
-    def __init__(self, serial: str):
+    def __init__(self, serial: str, renditions: typing.Dict[str, FrameProduct] = None,
+                 workers: int = None, max_in_flight: int = None, shared_memory: bool = True,
+                 dedup: bool = True, dedup_threshold: float = None, keepalive: float = 1.0,
+                 profile: bool = False, profile_hook: typing.Callable = None,
+                 record_stream: str = None):
+        """
+        Args:
+            serial (str): device serial number.
+            renditions (Dict[str, FrameProduct], optional): Named renditions viewers can pick
+                from, see `rendition`. Default is DEFAULT_RENDITIONS.
+            workers (int, optional): Decode worker processes. Default is `default_workers()`.
+            max_in_flight (int, optional): Frames decoded at the same time, newer frames
+                replace older ones while all are busy. Default is workers + 1.
+            shared_memory (bool, optional): Return decoded and encoded frames from the workers
+                through shared memory slots instead of pickling them. Default is True.
+            dedup (bool, optional): Skip frames identical to the last delivered one. Default is True.
+            dedup_threshold (float, optional): Also skip frames whose downsampled mean absolute
+                difference (0-255) is below this value. Default is None, exact duplicates only.
+            keepalive (float, optional): Deliver an unchanged frame anyway after this many
+                seconds. Default is 1.0.
+            profile (bool, optional): Record per-stage timestamps of every frame, see `stats`.
+                Default is False.
+            profile_hook (Callable, optional): Called with (seq, stamps) for every frame handed
+                to the subscribers, implies `profile`. Default is None.
+            record_stream (str, optional): Save the raw capture stream with arrival times to
+                this file, for replay with `ReplayObserver`. Default is None.
+        """
         super().__init__(serial)
 
+        self.renditions: typing.Dict[str, FrameProduct] = dict(renditions or DEFAULT_RENDITIONS)
+        self.workers = workers or default_workers()
+        self.max_in_flight = max_in_flight or self.workers + 1
+        self.shared_memory = shared_memory
+        self._frame_pool: typing.Optional[FramePool] = None
+        self._frame_slots: typing.Optional[SharedFrameSlots] = None
+        self._leased_slots: typing.Dict[int, SlotRef] = {}
+        self._dedup = FrameDeduplicator(dedup_threshold, keepalive) if dedup else None
+        self.profiler: typing.Optional[CapProfiler] = None
+        self._recv_time = 0.0
+        if profile or profile_hook:
+            self.enable_profiling(profile_hook)
+        self.record_stream = record_stream
         self.video_path = None
         self.subscribers: typing.List[CapSubscriber] = []
+        self._mailboxes: typing.Dict[int, Mailbox] = {}
+        self._mailbox_count = 0
         self.threads: typing.List[threading.Thread] = []
         self.stop_event = threading.Event()
         
@@ -77,7 +155,9 @@ class CapObserver(HmDriver):
         self.stop()
         
     def release(self):
-        self.stop()
+        if not self.stop_event.is_set():
+            self.stop()
+        self._close_mailboxes()
         self.subscribers.clear()
         super().release()
 
@@ -99,10 +179,112 @@ class CapObserver(HmDriver):
         }
         super()._send_msg(_msg)
 
-    def _on_capture(self, frames):
-        """Notify all subscribers of the new screen capture."""
-        for subscriber in self.subscribers:
-            subscriber.on_capture(frames)
+    @property
+    def capturing(self) -> bool:
+        """True while the capture thread runs, False after `stop` or when the device closed the stream."""
+        return not self.stop_event.is_set() and any(t.is_alive() for t in self.threads)
+
+    @property
+    def dropped_frames(self) -> int:
+        """Frames dropped because decoding fell behind."""
+        return self._frame_pool.dropped if self._frame_pool else 0
+
+    @property
+    def skipped_frames(self) -> int:
+        """Unchanged frames skipped by duplicate suppression."""
+        return self._dedup.skipped if self._dedup else 0
+
+    def enable_profiling(self, hook: typing.Callable = None) -> CapProfiler:
+        """Start recording per-stage timestamps, see `stats`.
+
+        Args:
+            hook (Callable, optional): called with (seq, stamps) for every frame handed to the subscribers.
+        """
+        if self.profiler is None:
+            self.profiler = CapProfiler(hook)
+        else:
+            self.profiler.hook = hook
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def stats(self) -> typing.Dict:
+        """Throughput counters and per-stage latency histograms, empty while not profiling.
+
+        Example:
+            {"frames": 1200, "fps": 29.8, "bytes_per_sec": 5.1e6, "dropped": 3, "skipped": 40,
+             "latency": {"split": {...}, "decode": {"p50": 10.0, "p90": 20.0, ...}, ...}}
+        """
+        profiler = self.profiler
+        if profiler is None:
+            return {}
+        return profiler.stats(self.dropped_frames, self.skipped_frames)
+
+    def _on_capture(self, frame: CapFrame):
+        """Hand the new screen capture to the mailbox of every subscriber."""
+        if self._frame_slots is not None:
+            self._frame_slots.attach(frame, self._leased_slots.pop(frame.seq, None))
+        profiler = self.profiler
+        if profiler is not None:
+            frame.stamps[STAGE_FANOUT] = time.time()
+        # mailboxes retain what they queue, subscribers must detach what they keep
+        frame.retain()
+        try:
+            for mailbox in list(self._mailboxes.values()):
+                mailbox.put(frame)
+        finally:
+            frame.release()
+        if profiler is not None:
+            profiler.record(frame)
+
+    def _on_delivered(self, name: str, frame: CapFrame, delivered: float):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.record_delivery(name, frame, delivered)
+
+    def delivery_stats(self) -> typing.Dict[str, typing.Dict]:
+        """Queued, delivered and dropped frames and lag in seconds, per subscriber mailbox."""
+        return {mailbox.name: mailbox.stats() for mailbox in list(self._mailboxes.values())}
+
+    def _on_drop(self, task: CapTask):
+        """Give back the slot of a frame that was dropped or failed to decode."""
+        slot = self._leased_slots.pop(task.seq, None)
+        if slot is not None:
+            self._frame_slots.release(slot.name)
+
+    def _lease_slot(self, seq: int, jpeg_image: bytes, products) -> typing.Optional[SlotRef]:
+        """Lease a shared memory slot big enough for the decoded products of a frame."""
+        if self._frame_slots is None or not needs_decode(products):
+            return None
+        size = jpeg_size(jpeg_image)
+        if size is None:
+            return None
+        slot = self._frame_slots.acquire(estimate_slot_size(*size, products))
+        if slot is not None:
+            self._leased_slots[seq] = slot
+        return slot
+
+    def _demand(self) -> typing.FrozenSet[FrameProduct]:
+        """Products requested by at least one subscriber."""
+        products = set()
+        # subscribers come and go on other threads
+        for subscriber in list(self.subscribers):
+            products.update(subscriber.products)
+        return frozenset(products)
+
+    def _capture_tasks(self):
+        """Attach sequence number, timestamp and current demand to each captured frame."""
+        for seq, jpeg_image in enumerate(_capture_reader(self)):
+            if self._dedup is not None and self._dedup.is_duplicate(jpeg_image):
+                # static screen, nothing to process or fan out
+                continue
+            now = time.time()
+            stamps = None
+            if self.profiler is not None:
+                stamps = {STAGE_RECV: self._recv_time or now, STAGE_SPLIT: now}
+            products = self._demand()
+            yield CapTask(seq, now, jpeg_image, products, self._lease_slot(seq, jpeg_image, products), stamps)
 
     def start(self):
         """Start screen capture.
@@ -122,12 +304,25 @@ class CapObserver(HmDriver):
 
         reply: str = self._recv_msg(1024, decode=True, print=False)
         if "true" in reply:
+            if self.record_stream:
+                self.sock = StreamTap(self.sock, self.record_stream)
+                logger.info(f"recording capture stream to {self.record_stream}")
+
             def _on_capture(thiz):
                 logger.debug("captrue loop start")
-                with Pool() as pool:
-                    for frames in pool.imap(_captrue_factory, _capture_reader(thiz)):
-                        if frames is not None:
-                            thiz._on_capture(frames)
+                if thiz.shared_memory:
+                    # in flight, pending and the frame being fanned out
+                    thiz._frame_slots = SharedFrameSlots(thiz.max_in_flight + 2)
+                try:
+                    with FramePool(_captrue_factory, thiz._on_capture, thiz.workers,
+                                   thiz.max_in_flight, on_drop=thiz._on_drop) as pool:
+                        thiz._frame_pool = pool
+                        for task in thiz._capture_tasks():
+                            # raw products only, no need to leave this thread
+                            pool.submit(task, inline=not needs_decode(task.products))
+                finally:
+                    if thiz._frame_slots is not None:
+                        thiz._frame_slots.close()
                 logger.debug("captrue loop exit")
             
             
@@ -156,7 +351,9 @@ class CapObserver(HmDriver):
 
             self._send_msg("stopCaptureScreen", [])
             self._recv_msg(1024, decode=True, print=False)
-            self.release()
+            # close the connection only, release() would call back into stop()
+            super().release()
+            self._close_mailboxes()
             # notify all subscribers that screen capture has stopped            
             for subscriber in self.subscribers:
                 subscriber.on_stop()
@@ -165,12 +362,41 @@ class CapObserver(HmDriver):
                     subscriber.on_error("Failed to stop device screen capture.")
             logger.error(f"An error occurred: {e}")
 
-    def subscribe(self, subscriber: CapSubscriber):
+    def rendition(self, name: str) -> FrameProduct:
+        """Look up a rendition by name.
+
+        Only renditions with at least one subscriber are computed, and all of
+        them share one decode of the device frame.
+
+        Args:
+            name (str): rendition name, e.g. "full", "half" or "quarter".
+
+        Raises:
+            KeyError: Unknown rendition name.
+        """
+        if name not in self.renditions:
+            raise KeyError(f"Unknown rendition {name}, available: {', '.join(self.renditions)}")
+        return self.renditions[name]
+
+    def subscribe(self, subscriber: CapSubscriber, policy: DeliveryPolicy = None, capacity: int = None):
         """Subscribe to screen capture.
 
+        Every subscriber gets its own bounded mailbox and delivery thread, so
+        a slow subscriber only falls behind itself.
+
         Args:
             subscriber (CaptureSubscriber): Subscriber to receive screen frames.
+            policy (DeliveryPolicy, optional): What to do when the subscriber falls behind.
+                Default is `subscriber.delivery`.
+            capacity (int, optional): Frames queued at most with DeliveryPolicy.LOSSLESS.
+                Default is `subscriber.mailbox_size`.
         """
+        self._mailbox_count += 1
+        name = f"{type(subscriber).__name__}#{self._mailbox_count}"
+        self._mailboxes[id(subscriber)] = Mailbox(subscriber, name,
+                                                  policy or subscriber.delivery,
+                                                  capacity or subscriber.mailbox_size,
+                                                  on_delivered=self._on_delivered)
         self.subscribers.append(subscriber)
         
     def unsubscribe(self, subscriber: CapSubscriber):
@@ -179,4 +405,13 @@ class CapObserver(HmDriver):
         Args:
             subscriber (CaptureSubscriber): Subscriber to unsubscribe.
         """
-        self.subscribers.remove(subscriber)
\ No newline at end of file
+        self.subscribers.remove(subscriber)
+        mailbox = self._mailboxes.pop(id(subscriber), None)
+        if mailbox is not None:
+            mailbox.close()
+
+    def _close_mailboxes(self):
+        """Deliver what lossless mailboxes hold and stop all delivery threads."""
+        mailboxes, self._mailboxes = self._mailboxes, {}
+        for mailbox in mailboxes.values():
+            mailbox.close()
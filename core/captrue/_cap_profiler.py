@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import time
+import bisect
+import typing
+import threading
+import collections
+
+from logzero import logger
+
+from ._cap_frame import CapFrame
+
+# latency histogram bucket upper bounds in milliseconds
+_BUCKETS_MS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 2000, 5000)
+
+# capture stages in pipeline order, recorded in CapFrame.stamps
+STAGE_RECV = "recv"
+STAGE_SPLIT = "split"
+STAGE_DECODE = "decode"
+STAGE_ENCODE = "encode"
+STAGE_FANOUT = "fanout"
+STAGE_DELIVER = "deliver"
+
+
+class LatencyHistogram:
+    """Fixed bucket latency histogram, cheap enough to update for every frame."""
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float):
+        self.counts[bisect.bisect_left(_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` (0-100) percentile, in milliseconds."""
+        if self.count == 0:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return float(_BUCKETS_MS[index]) if index < len(_BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self) -> typing.Dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": dict(zip([*map(str, _BUCKETS_MS), "inf"], self.counts)),
+        }
+
+
+class CapProfiler:
+    """Per-stage latency and throughput statistics of a CapObserver.
+
+    Latencies are measured from the arrival of the last chunk of a frame
+    (``recv``) to the end of each later stage, in milliseconds. Rates are
+    computed over the last `window` seconds.
+
+    Example:
+        observer = CapObserver(serial, profile=True, profile_hook=print)
+        ...
+        observer.profiler.stats()["latency"]["decode"]["p90"]
+    """
+
+    def __init__(self, hook: typing.Callable[[int, typing.Dict[str, float]], None] = None,
+                 window: float = 5.0):
+        """
+        Args:
+            hook (Callable, optional): called with (seq, stamps) for every frame handed to
+                the subscribers, for external collectors. Default is None.
+            window (float, optional): seconds covered by the fps and bytes/s rates. Default is 5.0.
+        """
+        self.hook = hook
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._started = time.time()
+            self._latency: typing.Dict[str, LatencyHistogram] = collections.defaultdict(LatencyHistogram)
+            self._frames = collections.deque()   # delivery times
+            self._bytes = collections.deque()    # (time, nbytes) received
+            self.frames = 0
+            self.bytes = 0
+
+    def count_bytes(self, nbytes: int, now: float):
+        with self._lock:
+            self.bytes += nbytes
+            self._bytes.append((now, nbytes))
+            self._expire(now)
+
+    def record(self, frame: CapFrame):
+        """Account the stage timestamps of a frame handed to the subscriber mailboxes."""
+        stamps = frame.stamps
+        start = stamps.get(STAGE_RECV)
+        if start is None:
+            return
+        with self._lock:
+            for stage, stamp in stamps.items():
+                if stage != STAGE_RECV:
+                    self._latency[stage].add((stamp - start) * 1000)
+            now = time.time()
+            self.frames += 1
+            self._frames.append(now)
+            self._expire(now)
+        if self.hook is not None:
+            try:
+                self.hook(frame.seq, dict(stamps))
+            except Exception as e:
+                logger.exception(e)
+
+    def record_delivery(self, name: str, frame: CapFrame, delivered: float):
+        """Account the delivery of a frame to the subscriber `name`."""
+        start = frame.stamps.get(STAGE_RECV)
+        if start is None:
+            return
+        with self._lock:
+            self._latency[f"{STAGE_DELIVER}.{name}"].add((delivered - start) * 1000)
+
+    def stats(self, dropped: int = 0, skipped: int = 0) -> typing.Dict:
+        """Snapshot of the counters, rates and latency histograms."""
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            span = min(self.window, max(now - self._started, 1e-6))
+            return {
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "dropped": dropped,
+                "skipped": skipped,
+                "fps": len(self._frames) / span,
+                "bytes_per_sec": sum(n for _, n in self._bytes) / span,
+                "latency": {stage: hist.to_dict() for stage, hist in self._latency.items()},
+            }
+
+    def _expire(self, now: float):
+        horizon = now - self.window
+        while self._frames and self._frames[0] < horizon:
+            self._frames.popleft()
+        while self._bytes and self._bytes[0][0] < horizon:
+            self._bytes.popleft()
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+from core.hmdriver2 import HmDriver
+from ._cap_observer import CapObserver
+from ._stream_tape import ReplaySocket
+
+# how long the reader may wait for the next replayed chunk before checking for stop
+_REPLAY_POLL = 0.2
+
+
+class _OfflineDriver(HmDriver):
+    """HmDriver without hdc, no device is needed to construct it."""
+
+    def __init__(self, serial: str):
+        self.hdc = None
+        self.sock = None
+
+    def _rm_local_port(self):
+        pass
+
+
+class ReplayObserver(CapObserver, _OfflineDriver):
+    """CapObserver fed from a capture tape instead of a device.
+
+    The tape goes through the same reader, decode pool and subscribers as a
+    live stream, which makes throughput and latency measurements repeatable
+    on hosts without a device. Record a tape with
+    `CapObserver(serial, record_stream=path)`.
+
+    Example:
+        with ReplayObserver("session.tape", realtime=False, profile=True) as observer:
+            observer.subscribe(CapSubscriber(PreviewJpeg()))
+            observer.start()
+            observer.wait()
+            print(observer.stats())
+    """
+
+    def __init__(self, path: str, realtime: bool = True, speed: float = 1.0, loops: int = 1,
+                 lossless: bool = None, **kwargs):
+        """
+        Args:
+            path (str): tape written by `CapObserver(record_stream=...)`.
+            realtime (bool, optional): Deliver chunks at their recorded pace, otherwise as
+                fast as the pipeline takes them. Default is True.
+            speed (float, optional): Pace multiplier in realtime mode. Default is 1.0.
+            loops (int, optional): Play the tape this many times. Default is 1.
+            lossless (bool, optional): Hold back reading while the decode pool is busy instead
+                of dropping frames, measures the throughput of the pipeline. Default is
+                True when not `realtime`.
+            **kwargs: CapObserver options.
+        """
+        super().__init__(f"replay:{path}", **kwargs)
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self.loops = loops
+        self.lossless = not realtime if lossless is None else lossless
+
+    def _connect_sock(self):
+        self.sock = ReplaySocket(self.path, self.realtime, self.speed, self.loops)
+        self.sock.settimeout(_REPLAY_POLL)
+
+    def _capture_tasks(self):
+        for task in super()._capture_tasks():
+            pool = self._frame_pool
+            if self.lossless and pool is not None:
+                # woken by each finished frame, the timeout only rechecks stop_event
+                while not pool.wait_free(_REPLAY_POLL) and not self.stop_event.is_set():
+                    pass
+            yield task
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the whole tape went through the pipeline.
+
+        Returns:
+            bool: False on timeout.
+        """
+        for t in self.threads:
+            t.join(timeout)
+            if t.is_alive():
+                return False
+        return True
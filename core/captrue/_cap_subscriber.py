@@ -3,24 +3,48 @@
 #
 # require: python >= 3.8
 
+import time
+import typing
 from logzero import logger
-import queue
+
+from ._cap_frame import CapFrame, FrameProduct, PreviewJpeg
+from ._mailbox import DeliveryPolicy
+from ._latest_frame import LatestFrame
+from ._cap_profiler import STAGE_SPLIT, STAGE_DELIVER
 
 class CapSubscriber:
+    # how CapObserver queues frames for this subscriber, see Mailbox
+    delivery: DeliveryPolicy = DeliveryPolicy.LATEST
+    mailbox_size: int = 1
     
-    def __init__(self):
-        self._frame_queue = queue.Queue(maxsize=2)
-        self._last_frame = None
+    def __init__(self, product: FrameProduct = PreviewJpeg()):
+        """
+        Args:
+            product (FrameProduct, optional): The frame product returned by `get_content`
+                and `wait_content`.
+                Default is a 0.3 scale preview JPEG, use RAW_JPEG to skip transcoding.
+        """
+        self.product = product
+        self.latest = LatestFrame()
+
+    @property
+    def products(self) -> typing.FrozenSet[FrameProduct]:
+        """Frame products this subscriber needs, CapObserver computes nothing else."""
+        return frozenset((self.product,))
 
     def release(self):
-        pass
+        self.latest.close()
 
-    def on_capture(self, frames):
+    def on_capture(self, frame: CapFrame):
         try:
-            if self._frame_queue.full():
-                self._frame_queue.get_nowait()
-            # get encoded frame
-            self._frame_queue.put_nowait(frames[1])
+            if self.product not in frame:
+                # subscribed after the frame was dispatched
+                return
+            stamps = dict(frame.stamps)
+            # the frame timestamp is when it was split from the stream
+            stamps[STAGE_SPLIT] = frame.timestamp
+            stamps[STAGE_DELIVER] = time.time()
+            self.latest.publish((frame.detach(self.product), stamps), frame.seq)
         except Exception as e:
             logger.exception(e)
 
@@ -34,9 +58,45 @@ class CapSubscriber:
         self.release()
         
     def get_content(self):
-        frame = self._frame_queue.get_nowait()
-        if frame is not None:
-            self._last_frame = frame
-        return self._last_frame
-    
-                
\ No newline at end of file
+        """The latest frame, None before the first one."""
+        _, value = self.latest.get()
+        return value[0] if value is not None else None
+
+    def wait_content(self, after: int = -1, timeout: float = None):
+        """Block until a frame newer than sequence number `after` arrives.
+
+        Returns:
+            (seq, frame), None on timeout or after the capture stopped.
+        """
+        return self._content(self.latest.wait(after, timeout))
+
+    async def wait_content_async(self, after: int = -1, timeout: float = None):
+        """Await a frame newer than sequence number `after`, see `wait_content`."""
+        return self._content(await self.latest.wait_async(after, timeout))
+
+    def wait_frame(self, after: int = -1, timeout: float = None):
+        """Like `wait_content`, with the stage timestamps of the frame.
+
+        Returns:
+            (seq, frame, stamps), stamps maps "split", "deliver" and, while the
+            observer is profiling, the other stages to time.time() values.
+        """
+        return self._frame(self.latest.wait(after, timeout))
+
+    async def wait_frame_async(self, after: int = -1, timeout: float = None):
+        """Await a frame newer than sequence number `after`, see `wait_frame`."""
+        return self._frame(await self.latest.wait_async(after, timeout))
+
+    @staticmethod
+    def _content(latest):
+        if latest is None:
+            return None
+        seq, (content, _) = latest
+        return seq, content
+
+    @staticmethod
+    def _frame(latest):
+        if latest is None:
+            return None
+        seq, (content, stamps) = latest
+        return seq, content, stamps
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import cv2
+import time
+import typing
+import hashlib
+
+import numpy as np
+
+
+class FrameDeduplicator:
+    """Detect frames that did not change since the last delivered one.
+
+    Every frame is compared by a hash of its raw bytes. With a `threshold`,
+    frames whose bytes differ are also compared with a 1/8 scale grayscale
+    decode, and count as unchanged when the mean absolute pixel difference
+    stays below the threshold (JPEG noise, blinking cursors).
+
+    An unchanged frame is still let through every `keepalive` seconds so
+    viewers and recorders keep receiving frames from an idle device.
+    """
+
+    def __init__(self, threshold: typing.Optional[float] = None, keepalive: float = 1.0):
+        """
+        Args:
+            threshold (float, optional): Mean absolute difference (0-255) under which a
+                changed frame still counts as unchanged. Default is None, exact duplicates only.
+            keepalive (float, optional): Seconds after which an unchanged frame is let
+                through anyway. Default is 1.0.
+        """
+        self.threshold = threshold
+        self.keepalive = keepalive
+        self._last_digest = None
+        self._last_thumb: typing.Optional[np.ndarray] = None
+        self._last_time = 0.0
+        self.skipped = 0
+
+    def is_duplicate(self, jpeg_image: bytes) -> bool:
+        """Check `jpeg_image` against the last frame let through, remember it if it is not a duplicate."""
+        now = time.monotonic()
+        digest = hashlib.blake2b(jpeg_image, digest_size=16).digest()
+        thumb = None
+        if digest == self._last_digest:
+            unchanged = True
+        elif self.threshold is None:
+            unchanged = False
+        else:
+            thumb = self._thumbnail(jpeg_image)
+            unchanged = (thumb is not None and self._last_thumb is not None
+                         and thumb.shape == self._last_thumb.shape
+                         and cv2.absdiff(thumb, self._last_thumb).mean() < self.threshold)
+
+        if unchanged and now - self._last_time < self.keepalive:
+            self.skipped += 1
+            return True
+
+        # viewers now see this frame, compare the next ones against it
+        self._last_time = now
+        if digest != self._last_digest:
+            self._last_digest = digest
+            if self.threshold is not None:
+                self._last_thumb = thumb if thumb is not None else self._thumbnail(jpeg_image)
+        return False
+
+    @staticmethod
+    def _thumbnail(jpeg_image: bytes) -> typing.Optional[np.ndarray]:
+        # libjpeg decodes straight to 1/8 scale, skipping most of the IDCT work
+        return cv2.imdecode(np.frombuffer(jpeg_image, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
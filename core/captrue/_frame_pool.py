@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import os
+import typing
+import threading
+import functools
+
+from logzero import logger
+from multiprocessing.pool import Pool
+
+
+def default_workers() -> int:
+    """Worker processes per capture session.
+
+    A device sends 30-60 fps and one core decodes and re-encodes a 1080p frame
+    in well under 20 ms, so a few workers are enough for one device. Using half
+    of the cores (at most 4) leaves room for other devices and the web server.
+    """
+    return max(1, min(4, (os.cpu_count() or 2) // 2))
+
+
+class FramePool:
+    """Process pool stage with a bounded number of frames in flight.
+
+    Unlike `Pool.imap`, `submit` never queues more than one frame: while all
+    in-flight slots are busy the newest frame waits in a single pending slot
+    and replaces (drops) any older frame waiting there, so latency stays
+    bounded when processing falls behind. Results are delivered to
+    `on_result` in submission order.
+
+    Example:
+        with FramePool(_captrue_factory, on_result, workers=2) as pool:
+            for task in tasks:
+                pool.submit(task)
+    """
+
+    def __init__(self, func: typing.Callable, on_result: typing.Callable,
+                 workers: int = None, max_in_flight: int = None, on_drop: typing.Callable = None):
+        """
+        Args:
+            func (Callable): picklable function run in the worker processes.
+            on_result (Callable): called with each result, in submission order.
+            workers (int, optional): Number of worker processes. Default is `default_workers()`.
+            max_in_flight (int, optional): Frames processed at the same time. Default is workers + 1.
+            on_drop (Callable, optional): called with each task that is dropped or fails.
+        """
+        self._func = func
+        self._on_result = on_result
+        self._on_drop = on_drop
+        self.workers = workers or default_workers()
+        self.max_in_flight = max_in_flight or self.workers + 1
+        self._pool: typing.Optional[Pool] = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._deliver_lock = threading.Lock()
+        self._in_flight = 0
+        self._pending = None
+        self._next_order = 0
+        self._next_deliver = 0
+        self._results: typing.Dict[int, typing.Any] = {}
+        self._tasks: typing.Dict[int, typing.Any] = {}
+        self._closed = False
+
+        self.submitted = 0
+        self.dropped = 0
+        self.delivered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def wait_free(self, timeout: float = None) -> bool:
+        """Block until a task can be dispatched without waiting in the pending slot.
+
+        Returns:
+            bool: False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight < self.max_in_flight or self._closed, timeout)
+
+    def submit(self, task, inline: bool = False) -> bool:
+        """Submit one task.
+
+        Args:
+            task: argument passed to `func`.
+            inline (bool, optional): Run `func` in the calling thread, for tasks cheaper
+                than the IPC round trip. The result is still delivered in order.
+
+        Returns:
+            bool: False if an older pending frame was dropped to make room.
+        """
+        if inline:
+            with self._lock:
+                order = self._reserve(task)
+            self._on_done(order, self._func(task), in_flight=False)
+            return True
+
+        with self._lock:
+            if self._in_flight < self.max_in_flight:
+                self._dispatch(task)
+                return True
+            dropped, self._pending = self._pending, task
+            if dropped is not None:
+                self.dropped += 1
+        if dropped is not None:
+            self._drop(dropped)
+        return dropped is None
+
+    def close(self, timeout: float = 5.0):
+        """Wait for in-flight frames to be delivered, then stop the workers."""
+        with self._idle:
+            pending, self._pending = self._pending, None
+            self._idle.wait_for(lambda: self._in_flight == 0, timeout)
+            self._closed = True
+        if pending is not None:
+            self._drop(pending)
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        logger.debug(f"frame pool closed, submitted {self.submitted} dropped {self.dropped}")
+
+    def _reserve(self, task) -> int:
+        order = self._next_order
+        self._next_order += 1
+        self._tasks[order] = task
+        self.submitted += 1
+        return order
+
+    def _drop(self, task):
+        if self._on_drop is not None:
+            self._on_drop(task)
+
+    def _dispatch(self, task):
+        """Send a task to the workers, must be called with the lock held."""
+        if self._pool is None:
+            self._pool = Pool(self.workers)
+        order = self._reserve(task)
+        self._in_flight += 1
+        self._pool.apply_async(self._func, (task,),
+                               callback=functools.partial(self._on_done, order),
+                               error_callback=functools.partial(self._on_error, order))
+
+    def _on_error(self, order: int, error: BaseException):
+        logger.error(f"Error processing frame: {error}")
+        self._on_done(order, None)
+
+    def _on_done(self, order: int, result, in_flight: bool = True):
+        with self._lock:
+            self._results[order] = result
+            if in_flight:
+                self._in_flight -= 1
+                if self._pending is not None and not self._closed:
+                    task, self._pending = self._pending, None
+                    self._dispatch(task)
+                self._idle.notify_all()
+
+        # deliveries may come from the pool result thread and inline submits
+        with self._deliver_lock:
+            while True:
+                with self._lock:
+                    if self._next_deliver not in self._results:
+                        return
+                    result = self._results.pop(self._next_deliver)
+                    task = self._tasks.pop(self._next_deliver)
+                    self._next_deliver += 1
+                if result is None:
+                    self._drop(task)
+                    continue
+                self.delivered += 1
+                try:
+                    self._on_result(result)
+                except Exception as e:
+                    logger.exception(e)
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import time
+import typing
+import threading
+import collections
+
+from logzero import logger
+
+from ._cap_subscriber import CapSubscriber
+from ._cap_frame import CapFrame, RAW_JPEG
+from ._mailbox import DeliveryPolicy
+from ._mjpeg_avi import MjpegAviWriter
+
+
+class InstantReplay(CapSubscriber):
+    """Keep the device JPEG frames of the last `seconds` in memory.
+
+    Nothing is written until `save_last` dumps the window to an MJPEG AVI,
+    e.g. when a test fails. The buffer holds at most `seconds` of frames and
+    at most `max_bytes` of JPEG data, the oldest frames are dropped first.
+    The buffer outlives the capture, so the frames before a crash can still
+    be saved; `release` frees it.
+
+    Example:
+        replay = InstantReplay(seconds=60, max_bytes=128 * 1024 * 1024)
+        observer.subscribe(replay)
+        ...
+        replay.save_last(30, "failure.avi")
+    """
+    # appending is cheap, keep every frame
+    delivery = DeliveryPolicy.LOSSLESS
+    mailbox_size = 30
+
+    def __init__(self, seconds: float = 60, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            seconds (float, optional): Time window kept in memory. Default is 60.
+            max_bytes (int, optional): Memory for JPEG data at most. Default is 64 MiB.
+        """
+        super().__init__(RAW_JPEG)
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self._frames: typing.Deque[typing.Tuple[float, bytes]] = collections.deque()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._stopped: typing.Optional[float] = None
+        self.evicted = 0
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._bytes
+
+    @property
+    def buffered_frames(self) -> int:
+        return len(self._frames)
+
+    @property
+    def buffered_seconds(self) -> float:
+        with self._lock:
+            return self._frames[-1][0] - self._frames[0][0] if self._frames else 0.0
+
+    def on_capture(self, frame: CapFrame):
+        if self.product not in frame:
+            return
+        jpeg_image = bytes(frame.detach(self.product))
+        if len(jpeg_image) > self.max_bytes:
+            return
+        with self._lock:
+            self._frames.append((frame.timestamp, jpeg_image))
+            self._bytes += len(jpeg_image)
+            self._evict(frame.timestamp - self.seconds)
+
+    def _evict(self, oldest: float):
+        while self._frames and (self._bytes > self.max_bytes or self._frames[0][0] < oldest):
+            _, jpeg_image = self._frames.popleft()
+            self._bytes -= len(jpeg_image)
+            self.evicted += 1
+
+    def on_start(self):
+        self._stopped = None
+
+    def on_stop(self):
+        # keep the frames for save_last, only wake the readers of `latest`
+        self._stopped = time.time()
+        super().release()
+
+    def on_error(self, error):
+        self.on_stop()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._bytes = 0
+
+    def save_last(self, seconds: float = None, path: str = "replay.avi") -> typing.List[str]:
+        """Write the frames of the last `seconds` to an MJPEG AVI with a timestamp sidecar.
+
+        Args:
+            seconds (float, optional): Length of the clip, up to the buffered window,
+                counted back from now or from when the capture stopped.
+                Default is the whole buffer.
+            path (str, optional): File to write. Default is "replay.avi".
+
+        Returns:
+            List[str]: files written, more than one if the resolution changed.
+        """
+        until = self._stopped or time.time()
+        since = until - (self.seconds if seconds is None else seconds)
+        with self._lock:
+            frames = [f for f in self._frames if f[0] >= since]
+        with MjpegAviWriter(path) as avi:
+            for timestamp, jpeg_image in frames:
+                avi.write(jpeg_image, timestamp)
+        logger.info(f"saved {len(frames)} frames of the last {until - since:.1f}s to {path}")
+        return avi.paths
+
+    def release(self):
+        """Free the buffer, called by the owner once the replay is no longer needed."""
+        self.clear()
+        super().release()
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import cv2
+import time
+import typing
+
+import numpy as np
+
+from ._jpeg_splitter import jpeg_size
+
+# libjpeg scaled decoding, 1/8 is the smallest scale it supports
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2), (1, cv2.IMREAD_COLOR))
+
+
+def reduced_factor(scale: float) -> typing.Tuple[int, int]:
+    """Pick the largest libjpeg reduction (1, 2, 4 or 8) that still covers `scale`.
+
+    Returns:
+        Tuple[int, int]: (factor, cv2 imread flag)
+    """
+    for factor, flag in _REDUCED_FLAGS:
+        if scale * factor <= 1.0 + 1e-6:
+            return factor, flag
+    return _REDUCED_FLAGS[-1]
+
+
+class ScaledDecoder:
+    """Decode a JPEG once and serve it resized to any scale up to `max_scale`.
+
+    The image is decoded straight to the smallest 1/2, 1/4 or 1/8 scale that
+    still covers `max_scale`, which skips most of the IDCT work, and only the
+    remaining resize is done with INTER_AREA. Output sizes are the same as a
+    full decode followed by ``cv2.resize(fx=scale, fy=scale)``.
+    """
+
+    def __init__(self, jpeg_image, max_scale: float = 1.0, reduced: bool = True):
+        """
+        Args:
+            jpeg_image (bytes): JPEG encoded image.
+            max_scale (float, optional): largest scale `get` will be asked for. Default is 1.0.
+            reduced (bool, optional): use libjpeg scaled decoding. Default is True.
+        """
+        self._jpeg_image = jpeg_image
+        self._size = jpeg_size(jpeg_image)
+        self._factor, self._flag = reduced_factor(max_scale) if reduced and self._size else _REDUCED_FLAGS[-1]
+        self._base: typing.Optional[np.ndarray] = None
+        self.decoded_at: typing.Optional[float] = None
+        self._scaled: typing.Dict[float, np.ndarray] = {}
+
+    @property
+    def factor(self) -> int:
+        return self._factor
+
+    def get(self, scale: float = 1.0) -> np.ndarray:
+        """Return the image resized by `scale` of the original size."""
+        if scale in self._scaled:
+            return self._scaled[scale]
+        if self._base is None:
+            self._base = cv2.imdecode(np.frombuffer(self._jpeg_image, np.uint8), self._flag)
+            if self._base is None:
+                raise ValueError("invalid jpeg image")
+            self.decoded_at = time.time()
+        if self._size is None:
+            # no SOF found, original size unknown, scale relative to the decoded image
+            image = self._base if scale == 1.0 else cv2.resize(
+                self._base, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            width, height = self._size
+            dsize = (max(1, round(width * scale)), max(1, round(height * scale)))
+            if self._base.shape[1::-1] == dsize:
+                image = self._base
+            else:
+                image = cv2.resize(self._base, dsize, interpolation=cv2.INTER_AREA)
+        self._scaled[scale] = image
+        return image
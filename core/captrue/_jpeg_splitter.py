@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import typing
+
+from logzero import logger
+
+
+# JPEG markers, see ITU T.81 table B.1
+_SOI = 0xD8
+_EOI = 0xD9
+_SOS = 0xDA
+_TEM = 0x01
+_RST0 = 0xD0
+_RST7 = 0xD7
+
+DEFAULT_CAPACITY = 8 * 1024 * 1024
+MIN_READ_SIZE = 256 * 1024
+
+
+class JpegSplitter:
+    """Incremental JPEG frame splitter for the uitest capture stream.
+
+    Data is received straight into a preallocated buffer with ``recv_into``
+    and parsed segment by segment, so every byte is scanned once and the
+    buffer is only compacted when the write position reaches its end.
+    Frame boundaries are taken from the JPEG segment lengths, an ``FFD9``
+    inside an APPn segment (e.g. an EXIF thumbnail) does not end the frame.
+
+    Example:
+        splitter = JpegSplitter()
+        while splitter.recv_into(sock):
+            for frame in splitter.frames():
+                handle(bytes(frame))
+
+    Note:
+        The memoryviews returned by `frames` point into the internal buffer,
+        they are only valid until the next call to `recv_into`.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._buf = bytearray(max(capacity, MIN_READ_SIZE * 2))
+        self._head = 0          # start of unconsumed data
+        self._tail = 0          # end of received data
+        self._pos = 0           # parser position
+        self._frame_start = -1  # SOI offset of the frame being parsed
+        self._in_scan = False   # inside entropy-coded data
+        self.frame_count = 0
+        self.resync_count = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buf)
+
+    @property
+    def pending(self) -> int:
+        """Number of received bytes not yet handed out as a frame."""
+        return self._tail - self._head
+
+    def writable(self) -> memoryview:
+        """Return the free tail of the buffer, compacting or growing it first if needed."""
+        if len(self._buf) - self._tail < MIN_READ_SIZE:
+            self._compact()
+        return memoryview(self._buf)[self._tail:]
+
+    def commit(self, nbytes: int):
+        """Mark `nbytes` written into the view returned by `writable` as received."""
+        self._tail += nbytes
+
+    def recv_into(self, sock) -> int:
+        """Receive data from `sock` (anything with a ``recv_into`` method).
+
+        Returns:
+            int: Number of bytes received, 0 when the peer closed the stream.
+        """
+        view = self.writable()
+        try:
+            nbytes = sock.recv_into(view)
+        finally:
+            view.release()
+        self.commit(nbytes)
+        return nbytes
+
+    def feed(self, data: typing.Union[bytes, bytearray, memoryview]) -> int:
+        """Copy `data` into the buffer, for sources without ``recv_into``."""
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            view = self.writable()
+            nbytes = min(len(view), len(data) - offset)
+            view[:nbytes] = data[offset:offset + nbytes]
+            view.release()
+            self.commit(nbytes)
+            offset += nbytes
+        return offset
+
+    def frames(self) -> typing.Iterator[memoryview]:
+        """Yield every complete JPEG frame received so far."""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def next_frame(self) -> typing.Optional[memoryview]:
+        """Return the next complete JPEG frame or None if more data is needed."""
+        buf = self._buf
+        tail = self._tail
+        pos = self._pos
+
+        while True:
+            if self._frame_start < 0:
+                idx = buf.find(b'\xff\xd8', pos, tail)
+                if idx < 0:
+                    # keep a trailing 0xFF, it may be the first half of the next SOI
+                    self._head = self._pos = max(self._head, tail - 1)
+                    return None
+                self._frame_start = self._head = idx
+                self._in_scan = False
+                pos = idx + 2
+                continue
+
+            if self._in_scan:
+                idx = buf.find(b'\xff', pos, tail)
+                if idx < 0 or idx + 1 >= tail:
+                    self._pos = tail if idx < 0 else idx
+                    return None
+                marker = buf[idx + 1]
+                if marker == 0x00 or _RST0 <= marker <= _RST7 or marker == 0xFF:
+                    # byte stuffing, restart marker or fill byte
+                    pos = idx + 1 if marker == 0xFF else idx + 2
+                    continue
+                self._in_scan = False
+                pos = idx
+                continue
+
+            if pos + 2 > tail:
+                self._pos = pos
+                return None
+            if buf[pos] != 0xFF:
+                pos = self._resync(pos)
+                continue
+            marker = buf[pos + 1]
+            if marker == 0xFF:
+                pos += 1
+            elif marker == _EOI:
+                end = pos + 2
+                start = self._frame_start
+                self._frame_start = -1
+                self._head = self._pos = end
+                self.frame_count += 1
+                return memoryview(buf)[start:end]
+            elif marker == _SOI:
+                # a new frame started before the previous one ended
+                pos = self._resync(pos)
+            elif marker == _TEM or _RST0 <= marker <= _RST7:
+                pos += 2
+            else:
+                if pos + 4 > tail:
+                    self._pos = pos
+                    return None
+                length = (buf[pos + 2] << 8) | buf[pos + 3]
+                if length < 2:
+                    pos = self._resync(pos)
+                    continue
+                pos += 2 + length
+                if marker == _SOS:
+                    self._in_scan = True
+                if pos > tail:
+                    # the segment continues in data not received yet
+                    self._pos = pos
+                    return None
+
+    def _resync(self, pos: int) -> int:
+        """Drop the corrupted frame and look for the next SOI from `pos`."""
+        logger.warning(f"corrupted jpeg frame at offset {pos - self._frame_start}, resync")
+        self.resync_count += 1
+        self._frame_start = -1
+        self._in_scan = False
+        self._head = pos
+        return pos
+
+    def _compact(self):
+        """Move the unconsumed data to the front, growing the buffer for oversized frames."""
+        pending = self._tail - self._head
+        if len(self._buf) - pending < MIN_READ_SIZE:
+            buf = bytearray(len(self._buf) * 2)
+            buf[:pending] = self._buf[self._head:self._tail]
+            self._buf = buf
+            logger.debug(f"jpeg splitter buffer grown to {len(buf)} bytes")
+        elif pending:
+            self._buf[:pending] = self._buf[self._head:self._tail]
+
+        shift = self._head
+        self._head = 0
+        self._tail = pending
+        self._pos -= shift
+        if self._frame_start >= 0:
+            self._frame_start -= shift
+
+
+def jpeg_size(data: typing.Union[bytes, bytearray, memoryview]) -> typing.Optional[typing.Tuple[int, int]]:
+    """Read (width, height) from the SOFn segment of a JPEG image without decoding it."""
+    data = memoryview(data)
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (_SOS, _EOI):
+            return None
+        length = (data[pos + 2] << 8) | data[pos + 3]
+        # SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if pos + 9 > len(data):
+                return None
+            height = (data[pos + 5] << 8) | data[pos + 6]
+            width = (data[pos + 7] << 8) | data[pos + 8]
+            return width, height
+        pos += 2 + length
+    return None
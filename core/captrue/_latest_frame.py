@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import time
+import typing
+import asyncio
+import threading
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LatestFrame:
+    """The most recent frame with its sequence number.
+
+    Readers remember the sequence number they last saw and block (`wait`) or
+    await (`wait_async`) until a newer frame is published, without polling.
+    Threads and asyncio tasks on any event loop can wait on the same slot.
+
+    Example:
+        seq = -1
+        while True:
+            seq, frame = await latest.wait_async(seq)
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = -1
+        self._value = None
+        self._closed = False
+        self._waiters: typing.List[typing.Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def get(self) -> typing.Tuple[int, typing.Any]:
+        """(seq, frame) of the latest frame, (-1, None) before the first one."""
+        with self._cond:
+            return self._seq, self._value
+
+    def publish(self, value, seq: int = None):
+        """Store a frame and wake all waiters. `seq` defaults to the previous one + 1."""
+        with self._cond:
+            self._seq = self._seq + 1 if seq is None else seq
+            self._value = value
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # the loop of that waiter is closed
+                pass
+
+    def close(self):
+        """Wake all waiters for good, later waits return at once."""
+        with self._cond:
+            self._closed = True
+        self.publish(self._value, self._seq)
+
+    def wait(self, after: int = -1, timeout: float = None) -> typing.Optional[typing.Tuple[int, typing.Any]]:
+        """Block until a frame newer than `after` is published.
+
+        Returns:
+            (seq, frame), None on timeout or when closed before a newer frame came.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after or self._closed, timeout):
+                return None
+            if self._seq <= after:
+                return None
+            return self._seq, self._value
+
+    async def wait_async(self, after: int = -1,
+                         timeout: float = None) -> typing.Optional[typing.Tuple[int, typing.Any]]:
+        """Coroutine version of `wait`, for the event loop it is awaited on."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._seq > after:
+                    return self._seq, self._value
+                if self._closed:
+                    return None
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            remaining = None if deadline is None else deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                with self._cond:
+                    if (loop, future) in self._waiters:
+                        self._waiters.remove((loop, future))
+                return None
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import time
+import typing
+import threading
+import collections
+from enum import Enum
+
+from logzero import logger
+
+from ._cap_frame import CapFrame
+
+
+class DeliveryPolicy(str, Enum):
+    """What a subscriber mailbox does when its subscriber falls behind."""
+    LATEST = "latest"       # keep only the newest frame, for live views
+    LOSSLESS = "lossless"   # keep every frame up to the capacity, for recordings
+
+
+class Mailbox:
+    """Bounded frame queue and delivery thread of one subscriber.
+
+    The capture thread only puts frames in; `on_capture` of the subscriber
+    runs on the mailbox thread, so a slow subscriber delays nobody else.
+    Queued frames are retained and released once delivered or dropped.
+
+    With LATEST a new frame replaces any undelivered one. With LOSSLESS
+    frames queue up to `capacity`, beyond that new frames are dropped until
+    the subscriber catches up.
+    """
+
+    def __init__(self, subscriber, name: str, policy: DeliveryPolicy = DeliveryPolicy.LATEST,
+                 capacity: int = None, on_delivered: typing.Callable = None):
+        """
+        Args:
+            subscriber (CapSubscriber): receives the frames.
+            name (str): name of the delivery thread and in the stats.
+            policy (DeliveryPolicy, optional): Default is DeliveryPolicy.LATEST.
+            capacity (int, optional): Queued frames at most, 1 for LATEST. Default is 1 or 60.
+            on_delivered (Callable, optional): called with (name, frame, delivered time)
+                after each delivery.
+        """
+        self.subscriber = subscriber
+        self.name = name
+        self.policy = DeliveryPolicy(policy)
+        self.capacity = 1 if self.policy is DeliveryPolicy.LATEST else max(1, capacity or 60)
+        self._on_delivered = on_delivered
+        self._queue: typing.Deque[CapFrame] = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._overflowing = False
+
+        self.delivered = 0
+        self.dropped = 0
+        self.lag = 0.0          # seconds from capture to delivery of the last frame
+
+        self._thread = threading.Thread(target=self._run, name=f"mailbox-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def put(self, frame: CapFrame):
+        """Queue a frame, never blocks."""
+        dropped = None
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._queue) >= self.capacity:
+                if self.policy is DeliveryPolicy.LATEST:
+                    dropped = self._queue.popleft()
+                else:
+                    self.dropped += 1
+                    if not self._overflowing:
+                        self._overflowing = True
+                        logger.warning(f"{self.name} is {len(self._queue)} frames behind, dropping frames")
+                    return
+                self.dropped += 1
+            elif len(self._queue) <= self.capacity // 2:
+                # caught up, warn again next time it falls behind
+                self._overflowing = False
+            frame.retain()
+            self._queue.append(frame)
+            self._cond.notify()
+        if dropped is not None:
+            dropped.release()
+
+    def close(self, drain: bool = None, timeout: float = 5.0):
+        """Stop the delivery thread.
+
+        Args:
+            drain (bool, optional): Deliver the queued frames first. Default is True for LOSSLESS.
+            timeout (float, optional): Seconds to wait for the thread. Default is 5.0.
+        """
+        drain = self.policy is DeliveryPolicy.LOSSLESS if drain is None else drain
+        with self._cond:
+            self._closed = True
+            dropped = [] if drain else list(self._queue)
+            if not drain:
+                self._queue.clear()
+            self._cond.notify()
+        for frame in dropped:
+            frame.release()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def stats(self) -> typing.Dict:
+        return {
+            "policy": self.policy.value,
+            "queued": len(self._queue),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "lag": self.lag,
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    break
+                frame = self._queue.popleft()
+            try:
+                self.subscriber.on_capture(frame)
+                now = time.time()
+                self.delivered += 1
+                self.lag = now - frame.timestamp
+                if self._on_delivered is not None:
+                    self._on_delivered(self.name, frame, now)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                frame.release()
+        logger.debug(f"mailbox {self.name} closed, delivered {self.delivered} dropped {self.dropped}")
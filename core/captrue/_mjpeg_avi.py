@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import os
+import cv2
+import time
+import struct
+import typing
+import multiprocessing
+
+from logzero import logger
+from pathlib import Path
+
+from ._jpeg_splitter import jpeg_size
+from ._recording_index import TimestampWriter
+
+_AVIF_HASINDEX = 0x10
+_AVIIF_KEYFRAME = 0x10
+# stay below the 2 GiB that AVI 1.0 readers handle reliably, then start a new segment
+MAX_SEGMENT_BYTES = 1900 * 1024 * 1024
+_HEADER_SIZE = 224
+
+
+def _chunk(fourcc: bytes, data: bytes) -> bytes:
+    return fourcc + struct.pack("<I", len(data)) + data + (b"\0" if len(data) % 2 else b"")
+
+
+def _avi_header(width: int, height: int, frames: int, fps: float, max_frame: int, movi_size: int) -> bytes:
+    """RIFF header up to and including the 'movi' list header, always _HEADER_SIZE bytes."""
+    scale, rate = 1000, max(1, round(fps * 1000))
+    avih = struct.pack("<14I", round(1e6 / fps), max_frame * round(fps), 0, _AVIF_HASINDEX,
+                       frames, 0, 1, max_frame, width, height, 0, 0, 0, 0)
+    strh = struct.pack("<4s4sIHHIIIIIIIIhhhh", b"vids", b"MJPG", 0, 0, 0, 0, scale, rate, 0,
+                       frames, max_frame, 0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack("<IiiHH4sIiiII", 40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0)
+    strl = b"LIST" + struct.pack("<I", 4 + 8 + len(strh) + 8 + len(strf)) + b"strl" + \
+        _chunk(b"strh", strh) + _chunk(b"strf", strf)
+    hdrl = b"LIST" + struct.pack("<I", 4 + 8 + len(avih) + len(strl)) + b"hdrl" + _chunk(b"avih", avih) + strl
+    riff_size = 4 + len(hdrl) + 12 + movi_size
+    header = b"RIFF" + struct.pack("<I", riff_size) + b"AVI " + hdrl + \
+        b"LIST" + struct.pack("<I", 4 + movi_size) + b"movi"
+    assert len(header) == _HEADER_SIZE
+    return header
+
+
+class MjpegAviWriter:
+    """Mux JPEG frames as they are into an MJPEG AVI, without decoding them.
+
+    The frame rate in the header is the average measured over the recording,
+    written on `close`. A new segment file (`name.1.avi`, `name.2.avi`, ...)
+    is started when the resolution changes, e.g. on rotation, or the file
+    approaches the AVI 1.0 size limit. With `timestamps` each segment gets a
+    sidecar with the capture time of every frame, see `RecordingIndex`.
+
+    Example:
+        with MjpegAviWriter("record.avi") as avi:
+            avi.write(jpeg_image)
+    """
+
+    def __init__(self, path: str, max_bytes: int = MAX_SEGMENT_BYTES, timestamps: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timestamps = timestamps
+        self._sidecar: typing.Optional[TimestampWriter] = None
+        self.paths: typing.List[str] = []
+        self.frames_written = 0
+        self._file: typing.Optional[typing.BinaryIO] = None
+        self._size: typing.Optional[typing.Tuple[int, int]] = None
+        self._index = bytearray()
+        self._frames = 0
+        self._movi_size = 0
+        self._max_frame = 0
+        self._first: typing.Optional[float] = None
+        self._last = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, jpeg_image: bytes, timestamp: float = None) -> bool:
+        """Append one JPEG frame captured at `timestamp` (time.time(), default now).
+
+        Returns:
+            bool: False if the frame is not a readable JPEG and was skipped.
+        """
+        size = jpeg_size(jpeg_image)
+        if size is None:
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        nbytes = len(jpeg_image) + len(jpeg_image) % 2 + 8
+        if self._file is None or size != self._size or \
+                _HEADER_SIZE + self._movi_size + nbytes + len(self._index) + 16 > self.max_bytes:
+            self._open_segment(size)
+
+        offset = 4 + self._movi_size    # from the 'movi' fourcc
+        self._file.write(_chunk(b"00dc", bytes(jpeg_image)))
+        self._index += struct.pack("<4sIII", b"00dc", _AVIIF_KEYFRAME, offset, len(jpeg_image))
+        self._movi_size += nbytes
+        self._max_frame = max(self._max_frame, len(jpeg_image))
+        self._frames += 1
+        self.frames_written += 1
+        if self._sidecar is not None:
+            self._sidecar.write(timestamp)
+        if self._first is None:
+            self._first = timestamp
+        self._last = timestamp
+        return True
+
+    def close(self):
+        """Write the index and the final header, the file is playable afterwards."""
+        if self._file is None:
+            return
+        self._file.write(_chunk(b"idx1", bytes(self._index)))
+        duration = self._last - self._first if self._first is not None else 0.0
+        fps = (self._frames - 1) / duration if self._frames > 1 and duration > 0 else 30.0
+        self._file.seek(0)
+        self._file.write(_avi_header(*self._size, self._frames, fps, self._max_frame, self._movi_size))
+        self._file.close()
+        self._file = None
+        if self._sidecar is not None:
+            self._sidecar.close()
+            self._sidecar = None
+        logger.debug(f"{self.paths[-1]}: {self._frames} frames, {fps:.1f} fps")
+
+    def _open_segment(self, size: typing.Tuple[int, int]):
+        self.close()
+        path = self.path
+        if self.paths:
+            stem, ext = os.path.splitext(self.path)
+            path = f"{stem}.{len(self.paths)}{ext}"
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(b"\0" * _HEADER_SIZE)
+        self.paths.append(path)
+        if self.timestamps:
+            self._sidecar = TimestampWriter(path)
+        self._size = size
+        self._index = bytearray()
+        self._frames = 0
+        self._movi_size = 0
+        self._max_frame = 0
+        self._first = None
+
+
+def transcode(src: str, dst: str, scale: float = 1.0, fourcc: str = "mp4v", fps: float = None) -> int:
+    """Re-encode a recording, e.g. an MJPEG AVI into a smaller mp4.
+
+    Args:
+        src (str): recording to read.
+        dst (str): file to write, its container follows the extension.
+        scale (float, optional): Resize factor. Default is 1.0.
+        fourcc (str, optional): Codec of `dst`. Default is "mp4v".
+        fps (float, optional): Frame rate of `dst`. Default is the rate of `src`.
+
+    Returns:
+        int: frames written.
+    """
+    capture = cv2.VideoCapture(src)
+    if not capture.isOpened():
+        raise IOError(f"cannot open {src}")
+    fps = fps or capture.get(cv2.CAP_PROP_FPS) or 30.0
+    writer = None
+    frames = 0
+    try:
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            if scale != 1.0:
+                image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if writer is None:
+                height, width = image.shape[:2]
+                writer = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+            writer.write(image)
+            frames += 1
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+    logger.info(f"transcoded {frames} frames from {src} to {dst}")
+    return frames
+
+
+def transcode_in_background(src: str, dst: str, **kwargs) -> multiprocessing.Process:
+    """Run `transcode` in a separate process, join it to wait for the result."""
+    process = multiprocessing.Process(target=transcode, args=(src, dst), kwargs=kwargs,
+                                      name=f"transcode-{os.path.basename(src)}")
+    process.start()
+    return process
@@ -0,0 +1,364 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import cv2
+import time
+import queue
+import typing
+import multiprocessing
+from enum import Enum
+
+import numpy as np
+from logzero import logger
+from multiprocessing import shared_memory
+
+from ._mjpeg_avi import MjpegAviWriter
+from ._recording_index import TimestampWriter
+from ._shm_frames import SharedArray
+
+_ALIGN = 64
+# a raw JPEG slot holds this many times the first frame, larger frames travel pickled
+_JPEG_HEADROOM = 3
+_MIN_JPEG_SLOT = 256 * 1024
+# the encoder starts while the capture, decode and server threads run, a fork could inherit held locks
+_SPAWN = multiprocessing.get_context("spawn")
+
+
+class OverflowPolicy(str, Enum):
+    """What the recording encoder does when all its frame slots are in use."""
+    DROP = "drop"       # drop the new frame, the recording skips ahead
+    BLOCK = "block"     # wait up to `block_timeout` for a free slot, then drop
+
+
+class VideoSink:
+    """Write the frames of a recording, runs in the encoder process.
+
+    Raw JPEG frames are muxed into an MJPEG AVI. Decoded frames are written
+    with the mp4v codec at a constant `fps`: each frame is placed in the slot
+    of its capture time, the previous frame is repeated while the screen does
+    not change and when the device sends faster the latest frame of a slot
+    supersedes the earlier ones. A slot is written once a frame of a later
+    slot arrives, or on `close`.
+    """
+
+    def __init__(self, video_path: str, raw: bool, fps: float):
+        self.video_path = video_path
+        self.raw = raw
+        self.fps = fps
+        self.frames_written = 0
+        self._avi: typing.Optional[MjpegAviWriter] = None
+        self._cv2_instance = None
+        self._sidecar: typing.Optional[TimestampWriter] = None
+        self._start: typing.Optional[float] = None
+        self._slots = 0
+        self._last_frame = None
+        self._last_timestamp = 0.0
+        # latest frame of the slot not written yet, and a buffer to copy the next one into
+        self._held = None
+        self._held_slot = 0
+        self._held_timestamp = 0.0
+        self._spare = None
+        self.superseded = 0
+        self.late = 0           # captured before the held frame, i.e. delivered out of order
+
+    @property
+    def paths(self) -> typing.List[str]:
+        return self._avi.paths if self._avi is not None else [self.video_path]
+
+    def write(self, frame, timestamp: float):
+        """Write a frame, it is not referenced after the call returns."""
+        if self.raw:
+            if self._avi is None:
+                self._avi = MjpegAviWriter(self.video_path)
+            # a shared memory view is copied, the slot is reused once this returns
+            if self._avi.write(bytes(frame), timestamp):
+                self.frames_written += 1
+        else:
+            self._write_constant_rate(frame, timestamp)
+
+    def close(self):
+        if self._held is not None:
+            self._write_held()
+        if self._cv2_instance is not None:
+            logger.debug(f"{self.video_path}: {self.frames_written} frames written, "
+                         f"{self.superseded} superseded, {self.late} late")
+            self._cv2_instance.release()
+            self._cv2_instance = None
+        if self._sidecar is not None:
+            self._sidecar.close()
+            self._sidecar = None
+        self._last_frame = None
+        self._spare = None
+        if self._avi is not None:
+            self._avi.close()
+
+    def _write_constant_rate(self, frame, timestamp: float):
+        if self._cv2_instance is None:
+            height, width = frame.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self._cv2_instance = cv2.VideoWriter(self.video_path, fourcc, self.fps, (width, height))
+            self._sidecar = TimestampWriter(self.video_path)
+            self._start = timestamp
+            self._slots = 0
+        # the frame belongs in the slot of its capture time, the latest one of a slot wins
+        slot = round((timestamp - self._start) * self.fps)
+        if self._held is not None:
+            if slot < self._held_slot or timestamp < self._held_timestamp:
+                self.late += 1
+                return
+            if slot == self._held_slot:
+                self.superseded += 1
+            else:
+                self._write_held()
+        self._hold(frame, timestamp, slot)
+
+    def _hold(self, frame, timestamp: float, slot: int):
+        # the slot of `frame` is reused once write returns, copy it
+        buffer = self._held if self._held is not None else self._spare
+        if buffer is None or buffer.shape != frame.shape or buffer.dtype != frame.dtype:
+            buffer = frame.copy()
+        else:
+            np.copyto(buffer, frame)
+        self._held, self._spare = buffer, None
+        self._held_slot = slot
+        self._held_timestamp = timestamp
+
+    def _write_held(self):
+        # the previous frame fills the slots without a frame of their own
+        while self._slots < self._held_slot:
+            self._write_frame(self._last_frame, self._last_timestamp, repeat=True)
+        self._write_frame(self._held, self._held_timestamp)
+        self._spare, self._last_frame, self._held = self._last_frame, self._held, None
+        self._last_timestamp = self._held_timestamp
+
+    def _write_frame(self, frame, timestamp: float, repeat: bool = False):
+        # the sidecar keeps when the frame was captured, not the time of its slot
+        self._cv2_instance.write(frame)
+        self._sidecar.write(timestamp, repeat)
+        self._slots += 1
+        self.frames_written += 1
+
+
+def _encoder_main(sink: VideoSink, tasks: multiprocessing.Queue, free: multiprocessing.Queue,
+                  done, written, results: multiprocessing.Queue):
+    """Encoder process: write the frames of `tasks` until None, return each slot to `free`."""
+    shm = None
+    slot_size = 0
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if len(task) == 2:
+                # the ring, created with the first frame
+                shm_name, slot_size = task
+                shm = shared_memory.SharedMemory(name=shm_name)
+                continue
+            index, data, timestamp = task
+            try:
+                if isinstance(data, SharedArray):
+                    data = np.ndarray(data.shape, np.dtype(data.dtype), buffer=shm.buf,
+                                      offset=index * slot_size + data.offset)
+                sink.write(data, timestamp)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                data = None
+                free.put(index)
+            done.value += 1
+            written.value = sink.frames_written
+    finally:
+        sink.close()
+        written.value = sink.frames_written
+        results.put(sink.paths)
+        if shm is not None:
+            shm.close()
+
+
+class RecordingEncoder:
+    """Encode a recording in a separate process, fed through shared memory.
+
+    `put` copies a frame into one of `capacity` fixed size slots of a shared
+    memory ring and sends only its descriptor to the encoder process, which
+    returns the slot once the frame is written. So at most `capacity` frames
+    are buffered, whatever the encoder speed, and encoding does not compete
+    with the capture and web server threads for the GIL. When every slot is
+    in use the `policy` decides between dropping the frame and waiting.
+
+    `start` spawns the process, the ring is created with the first frame,
+    which sets the slot size. A frame that does not fit, e.g. an unusually
+    large JPEG, still takes a slot but travels pickled.
+
+    Example:
+        encoder = RecordingEncoder(VideoSink("record.avi", raw=True, fps=10))
+        encoder.start()
+        encoder.put(jpeg_image, timestamp)
+        paths = encoder.close()
+    """
+
+    def __init__(self, sink: VideoSink, capacity: int = 60,
+                 policy: OverflowPolicy = OverflowPolicy.DROP, block_timeout: float = 1.0):
+        """
+        Args:
+            sink (VideoSink): writer handed over to the encoder process.
+            capacity (int, optional): Frames buffered at most. Default is 60.
+            policy (OverflowPolicy, optional): Default is OverflowPolicy.DROP.
+            block_timeout (float, optional): Seconds `put` waits for a slot with BLOCK. Default is 1.0.
+        """
+        self.sink = sink
+        self.capacity = max(1, capacity)
+        self.policy = OverflowPolicy(policy)
+        self.block_timeout = block_timeout
+        self.slot_size = 0
+        self._shm: typing.Optional[shared_memory.SharedMemory] = None
+        self._process: typing.Optional[multiprocessing.process.BaseProcess] = None
+        self._tasks: typing.Optional[multiprocessing.Queue] = None
+        self._free: typing.Optional[multiprocessing.Queue] = None
+        self._results: typing.Optional[multiprocessing.Queue] = None
+        self._done = _SPAWN.Value("q", 0, lock=False)
+        self._written = _SPAWN.Value("q", 0, lock=False)
+        self._unused: typing.List[int] = []
+        self._paths: typing.Optional[typing.List[str]] = None
+        self._overflowing = False
+        self._closed = False
+
+        self.queued = 0
+        self.dropped = 0
+        self.oversized = 0
+        self.blocked = 0.0      # seconds `put` spent waiting for a slot
+
+    @property
+    def written(self) -> int:
+        return self._written.value
+
+    @property
+    def in_flight(self) -> int:
+        """Frames handed to the encoder and not written yet."""
+        return self.queued - self._done.value
+
+    @property
+    def paths(self) -> typing.List[str]:
+        """Files of the recording, complete after `close`."""
+        return self._paths if self._paths is not None else self.sink.paths
+
+    def put(self, frame: typing.Union[bytes, np.ndarray], timestamp: float) -> bool:
+        """Queue a raw JPEG or decoded frame, it is copied before returning.
+
+        Returns:
+            bool: False if the frame was dropped.
+        """
+        if self._closed:
+            return False
+        nbytes = frame.nbytes if isinstance(frame, np.ndarray) else len(frame)
+        if self._process is None:
+            self.start()
+        if self._shm is None:
+            self._open(nbytes)
+        index = self._acquire()
+        if index is None:
+            self.dropped += 1
+            if not self._overflowing:
+                self._overflowing = True
+                logger.warning(f"recording encoder is {self.capacity} frames behind, dropping frames")
+            if not self._process.is_alive():
+                logger.error(f"recording encoder exited with {self._process.exitcode}")
+            return False
+        if self.in_flight <= self.capacity // 2:
+            # caught up, warn again next time it falls behind
+            self._overflowing = False
+
+        offset = index * self.slot_size
+        if nbytes > self.slot_size:
+            self.oversized += 1
+            # pickled by the queue feeder thread after put returns, the caller's buffer may be reused by then
+            data = bytes(frame) if isinstance(frame, (bytes, memoryview)) else frame.copy()
+        elif isinstance(frame, np.ndarray):
+            np.ndarray(frame.shape, frame.dtype, buffer=self._shm.buf, offset=offset)[...] = frame
+            data = SharedArray(0, frame.shape, frame.dtype.str)
+        else:
+            self._shm.buf[offset:offset + nbytes] = frame
+            data = SharedArray(0, (nbytes,), np.dtype(np.uint8).str)
+        self._tasks.put((index, data, timestamp))
+        self.queued += 1
+        return True
+
+    def start(self):
+        """Spawn the encoder process, `put` does it on the first frame otherwise."""
+        if self._process is not None or self._closed:
+            return
+        self._tasks = _SPAWN.Queue()
+        self._free = _SPAWN.Queue()
+        self._results = _SPAWN.Queue()
+        self._process = _SPAWN.Process(
+            target=_encoder_main, name="recording-encoder", daemon=True,
+            args=(self.sink, self._tasks, self._free, self._done, self._written, self._results))
+        self._process.start()
+        logger.debug("recording encoder started")
+
+    def close(self, timeout: float = 30.0) -> typing.List[str]:
+        """Write the buffered frames, finalize the file and stop the encoder process.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the encoder. Default is 30.0.
+
+        Returns:
+            List[str]: files of the recording.
+        """
+        if self._closed:
+            return self.paths
+        self._closed = True
+        if self._process is None:
+            return self.paths
+        self._tasks.put(None)
+        try:
+            self._paths = self._results.get(timeout=timeout)
+        except queue.Empty:
+            logger.error(f"recording encoder did not finish in {timeout}s, {self.in_flight} frames lost")
+        self._process.join(1.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+        logger.debug(f"recording encoder closed, queued {self.queued} written {self.written} "
+                      f"dropped {self.dropped} oversized {self.oversized}")
+        return self.paths
+
+    def stats(self) -> typing.Dict:
+        return {
+            "policy": self.policy.value,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "oversized": self.oversized,
+            "blocked": self.blocked,
+        }
+
+    def _open(self, nbytes: int):
+        if self.sink.raw:
+            nbytes = max(nbytes * _JPEG_HEADROOM, _MIN_JPEG_SLOT)
+        self.slot_size = (nbytes + _ALIGN - 1) // _ALIGN * _ALIGN
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slot_size * self.capacity)
+        self._unused = list(range(self.capacity))
+        self._tasks.put((self._shm.name, self.slot_size))
+        logger.debug(f"recording encoder ring of {self.capacity} slots of {self.slot_size} bytes")
+
+    def _acquire(self) -> typing.Optional[int]:
+        if self._unused:
+            return self._unused.pop()
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            if self.policy is not OverflowPolicy.BLOCK:
+                return None
+        start = time.monotonic()
+        try:
+            return self._free.get(timeout=self.block_timeout)
+        except queue.Empty:
+            return None
+        finally:
+            self.blocked += time.monotonic() - start
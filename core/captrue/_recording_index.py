@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import os
+import cv2
+import bisect
+import typing
+
+from logzero import logger
+
+_HEADER = "# timecode format v2"
+_START = "# start "
+_REPEAT = "# repeat"
+
+
+def sidecar_path(video_path: str) -> str:
+    """Timestamp sidecar of a recording, `record.avi` -> `record.avi.timestamps.txt`."""
+    return f"{video_path}.timestamps.txt"
+
+
+class TimestampWriter:
+    """Write the presentation time of every frame of a recording.
+
+    The file is in the mkvmerge timecode v2 format, one line per frame in
+    milliseconds from the first frame. A comment line keeps the wall clock
+    time of the first frame. The sidecar of a raw AVI recording makes a true
+    variable frame rate MKV with `mkvmerge -o out.mkv --timestamps 0:<sidecar> <video>`.
+
+    In a constant rate recording a `# repeat` comment precedes a frame that
+    repeats the previous one to fill a slot. It keeps the capture time of that
+    frame, so those timestamps are not strictly increasing and the sidecar
+    is for `RecordingIndex` only, not for mkvmerge.
+    """
+
+    def __init__(self, video_path: str):
+        self.path = sidecar_path(video_path)
+        self._file = open(self.path, "w")
+        self._start: typing.Optional[float] = None
+
+    def write(self, timestamp: float, repeat: bool = False):
+        """Add the next frame, captured at `timestamp` (time.time()).
+
+        Args:
+            timestamp (float): capture time of the frame.
+            repeat (bool, optional): The frame repeats the previous one. Default is False.
+        """
+        if self._start is None:
+            self._start = timestamp
+            self._file.write(f"{_HEADER}\n{_START}{timestamp:.6f}\n")
+        if repeat:
+            self._file.write(f"{_REPEAT}\n")
+        self._file.write(f"{(timestamp - self._start) * 1000:.3f}\n")
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class RecordingIndex:
+    """Capture times of the frames of a recording, read from its sidecar.
+
+    Example:
+        index = RecordingIndex("record.avi")
+        capture = index.open_at(failed_at - 2.0)
+        ok, image = capture.read()
+    """
+
+    def __init__(self, video_path: str):
+        self.video_path = video_path
+        self.start = 0.0
+        self.timestamps: typing.List[float] = []
+        # frames that repeat the previous one
+        self.repeats: typing.Set[int] = set()
+        repeat = False
+        with open(sidecar_path(video_path)) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith(_START):
+                    self.start = float(line[len(_START):])
+                elif line == _REPEAT:
+                    repeat = True
+                elif line and not line.startswith("#"):
+                    if repeat:
+                        self.repeats.add(len(self.timestamps))
+                        repeat = False
+                    self.timestamps.append(self.start + float(line) / 1000)
+        logger.debug(f"{video_path}: {len(self.timestamps)} frames from {self.start:.3f}")
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def end(self) -> float:
+        return self.timestamps[-1] if self.timestamps else self.start
+
+    def time_of(self, frame: int) -> float:
+        """Wall clock time at which frame number `frame` was captured."""
+        return self.timestamps[frame]
+
+    def is_repeat(self, frame: int) -> bool:
+        """True if frame number `frame` only repeats the previous one."""
+        return frame in self.repeats
+
+    def frame_at(self, wall_time: float) -> int:
+        """Number of the frame on screen at `wall_time`, i.e. the last one captured before it.
+
+        Raises:
+            ValueError: `wall_time` is before the recording.
+        """
+        if not self.timestamps or wall_time < self.start:
+            raise ValueError(f"{wall_time:.3f} is not in {self.video_path}")
+        return max(0, bisect.bisect_right(self.timestamps, wall_time) - 1)
+
+    def open_at(self, wall_time: float) -> cv2.VideoCapture:
+        """Open the recording, positioned so the next read returns the frame at `wall_time`."""
+        frame = self.frame_at(wall_time)
+        capture = cv2.VideoCapture(self.video_path)
+        if not capture.isOpened():
+            raise IOError(f"cannot open {self.video_path}")
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        return capture
+
+    @classmethod
+    def find(cls, video_paths: typing.Iterable[str], wall_time: float) -> typing.Tuple["RecordingIndex", int]:
+        """Index and frame number at `wall_time` among the segments of a recording."""
+        found = None
+        for path in video_paths:
+            if os.path.exists(sidecar_path(path)):
+                index = cls(path)
+                if index.timestamps and index.start <= wall_time:
+                    found = index
+        if found is None:
+            raise ValueError(f"{wall_time:.3f} is not in the recording")
+        return found, found.frame_at(wall_time)
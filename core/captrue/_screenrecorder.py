@@ -3,38 +3,82 @@
 #
 # require: python >= 3.8
 
-import cv2
-import queue
-import threading
-import time
+import typing
 
 from logzero import logger
 from pathlib import Path
 from ._cap_subscriber import CapSubscriber
+from ._cap_frame import CapFrame, FrameProduct, DecodedBgr, RAW_JPEG
+from ._recording_encoder import RecordingEncoder, VideoSink, OverflowPolicy
+from ._mailbox import DeliveryPolicy
 
 class ScreenRecorder(CapSubscriber):
-    def __init__(self, video_path: str):
+    # a recording wants every frame, up to about two seconds of backlog
+    delivery = DeliveryPolicy.LOSSLESS
+    mailbox_size = 120
+
+    def __init__(self, video_path: str, scale: float = 0.3, raw: bool = False, fps: float = 10,
+                 buffer_frames: int = 60, overflow: OverflowPolicy = OverflowPolicy.DROP):
+        """
+        Every recording gets a `<video_path>.timestamps.txt` sidecar with the
+        capture time of each frame, open it with `RecordingIndex` to seek to a
+        wall clock time. Frames are encoded in a separate process, see
+        `RecordingEncoder`.
+
+        Args:
+            video_path (str): file to record into.
+            scale (float, optional): Resize factor of the mp4v recording. Default is 0.3.
+            fps (float, optional): Frame rate of the mp4v recording. Frames are placed by their
+                capture time, repeated while the screen does not change and skipped when
+                the device sends faster, so playback runs in real time. Default is 10.
+            raw (bool, optional): Mux the device JPEG frames as they are into an MJPEG AVI,
+                at full resolution with no decode or encode. Use `transcode` to make a
+                smaller file afterwards. Default is False.
+            buffer_frames (int, optional): Frames buffered for the encoder at most. Default is 60.
+            overflow (OverflowPolicy, optional): What to do when the buffer is full.
+                Default is OverflowPolicy.DROP.
+        """
+        super().__init__(RAW_JPEG if raw else DecodedBgr(scale))
+        self.raw = raw
+        if raw and Path(video_path).suffix.lower() != ".avi":
+            video_path = str(Path(video_path).with_suffix(".avi"))
+            logger.warning(f"raw recordings are MJPEG AVI files, recording to {video_path}")
         self._video_path = video_path
-        self.cv2_instance = None
-        self.stop_event = threading.Event()
-        self._frame_queue = queue.Queue()
-        self._record_th = None
+        self.fps = fps
+        self._encoder = RecordingEncoder(VideoSink(video_path, raw, fps), buffer_frames, overflow)
         self._is_recording = False
     
     @property
     def is_recording(self):
-        return self.cv2_instance is not None
+        return self._is_recording
     
+    @property
+    def products(self) -> typing.FrozenSet[FrameProduct]:
+        # nothing to decode while not recording
+        return frozenset((self.product,)) if self._is_recording else frozenset()
+
     @property
     def video_path(self):
         return self._video_path
+
+    @property
+    def video_paths(self) -> typing.List[str]:
+        """All files of the recording, raw recordings start a new file on rotation."""
+        return self._encoder.paths
+
+    @property
+    def frames_written(self) -> int:
+        return self._encoder.written
+
+    def stats(self) -> typing.Dict:
+        """Encoder buffer and drop counters, see `RecordingEncoder.stats`."""
+        return self._encoder.stats()
     
     def start(self):
         try:
             Path(self._video_path).parent.mkdir(parents=True, exist_ok=True)
-            self._record_th = threading.Thread(target=self._video_writer, args=(self._video_path,))
-            self._record_th.daemon = True
-            self._record_th.start()
+            # spawn the encoder here, not from the mailbox thread of the first frame
+            self._encoder.start()
             self._is_recording = True
         except Exception as e:
             logger.exception(e)
@@ -43,32 +87,13 @@ class ScreenRecorder(CapSubscriber):
         self.release()
 
     def release(self):
+        """Write the buffered frames and finalize the file."""
         self._is_recording = False
-        self.stop_event.set()
-        if self._record_th is not None:
-            self._record_th.join()
-
-        if self.cv2_instance is not None:
-            self.cv2_instance.release()
-            self.cv2_instance = None
+        self._encoder.close()
         super().release()
     
-    def on_capture(self, frames):
-        """Write frames to video file."""
-        if self._is_recording is False:
-            return        
-        # super().on_capture(jpeg_frame)
-        self._frame_queue.put_nowait(frames[0])
-        
-    def _video_writer(self):        
-        while not self.stop_event.is_set():
-            if not self._frame_queue.empty():
-                frame = self._frame_queue.get(timeout=0.1)
-                if frame is not None:
-                    if cv2_instance is None:
-                        height, width = frame.shape[:2]
-                        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                        cv2_instance = cv2.VideoWriter(self._video_path, fourcc, 10, (width, height))
-                    cv2_instance.write(frame)    
-            else:
-                time.sleep(0.01)
+    def on_capture(self, frame: CapFrame):
+        """Hand frames to the encoder, which copies them into its buffer."""
+        if self._is_recording is False or self.product not in frame:
+            return
+        self._encoder.put(frame[self.product], frame.timestamp)
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import typing
+import threading
+import collections
+from dataclasses import dataclass
+
+import numpy as np
+from logzero import logger
+from multiprocessing import shared_memory
+
+from ._cap_frame import CapFrame, FrameProduct, DecodedBgr, PreviewJpeg
+
+_ALIGN = 64
+_ATTACH_CACHE_SIZE = 16
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Descriptor of an ndarray written into a shared memory slot."""
+    offset: int
+    shape: tuple
+    dtype: str
+
+
+@dataclass(frozen=True)
+class SlotRef:
+    """The slot a worker may write its output into."""
+    name: str
+    size: int
+
+
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def estimate_slot_size(width: int, height: int, products: typing.Iterable[FrameProduct]) -> int:
+    """Bytes needed for the decoded and encoded products of a `width` x `height` frame.
+
+    An encoded JPEG is budgeted like its decoded image, which it practically
+    never exceeds; outputs that still do not fit are sent back pickled.
+    """
+    size = 0
+    for product in products:
+        if isinstance(product, (DecodedBgr, PreviewJpeg)):
+            size += _align(round(width * product.scale) * round(height * product.scale) * 3)
+    return size
+
+
+class SlotWriter:
+    """Worker side of a slot, hands out the space for each output in turn."""
+
+    _attached: typing.Dict[str, shared_memory.SharedMemory] = collections.OrderedDict()
+
+    def __init__(self, slot: typing.Optional[SlotRef]):
+        self._buf = self._attach(slot.name).buf if slot else None
+        self._size = slot.size if slot else 0
+        self._base = np.frombuffer(self._buf, np.uint8).ctypes.data if slot else 0
+        self._offset = 0
+
+    @classmethod
+    def _attach(cls, name: str) -> shared_memory.SharedMemory:
+        if name not in cls._attached:
+            # slots of older generations are unlinked by the parent, forget them
+            while len(cls._attached) >= _ATTACH_CACHE_SIZE:
+                _, shm = cls._attached.popitem(last=False)
+                shm.close()
+            cls._attached[name] = shared_memory.SharedMemory(name=name)
+        return cls._attached[name]
+
+    def empty(self, shape: tuple) -> typing.Optional[np.ndarray]:
+        """Allocate a uint8 array in the slot, None if it does not fit."""
+        nbytes = int(np.prod(shape))
+        if self._buf is None or self._offset + nbytes > self._size:
+            return None
+        array = np.ndarray(shape, np.uint8, buffer=self._buf, offset=self._offset)
+        self._offset += _align(nbytes)
+        return array
+
+    def describe(self, array: np.ndarray) -> typing.Union[SharedArray, np.ndarray]:
+        """Return the descriptor of an array in the slot, copying it in if needed.
+
+        Arrays that do not fit are returned as-is and travel pickled.
+        """
+        if not self._in_slot(array):
+            shared = self.empty(array.shape) if array.dtype == np.uint8 else None
+            if shared is None:
+                return array
+            shared[...] = array
+            array = shared
+        return SharedArray(array.ctypes.data - self._base, array.shape, array.dtype.str)
+
+    def _in_slot(self, array: np.ndarray) -> bool:
+        return self._buf is not None and self._base <= array.ctypes.data < self._base + self._size
+
+
+class SharedFrameSlots:
+    """Parent side pool of reusable shared memory slots for decoded frames.
+
+    Workers write their output into a slot and only send back `SharedArray`
+    descriptors, `attach` turns them into ndarrays reading the slot in place.
+    A slot returns to the pool when the frame is released by every reader.
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+        self.slot_size = 0
+        self._lock = threading.Lock()
+        self._free: typing.List[shared_memory.SharedMemory] = []
+        self._slots: typing.Dict[str, shared_memory.SharedMemory] = {}
+        self._closed = False
+
+    def acquire(self, nbytes: int) -> typing.Optional[SlotRef]:
+        """Lease a slot of at least `nbytes`, None if all slots are in use."""
+        if nbytes <= 0:
+            return None
+        with self._lock:
+            if self._closed:
+                return None
+            if nbytes > self.slot_size:
+                # resolution or products changed, start a new generation of slots
+                for shm in self._free:
+                    self._unlink(shm)
+                self._free.clear()
+                self.slot_size = _align(nbytes + nbytes // 4)
+                logger.debug(f"shared frame slot size {self.slot_size}")
+            if self._free:
+                shm = self._free.pop()
+            elif len(self._slots) < self.count:
+                shm = shared_memory.SharedMemory(create=True, size=self.slot_size)
+                self._slots[shm.name] = shm
+            else:
+                return None
+            return SlotRef(shm.name, shm.size)
+
+    def release(self, name: str):
+        """Return a slot to the pool."""
+        with self._lock:
+            shm = self._slots.get(name)
+            if shm is None:
+                return
+            if self._closed or shm.size < self.slot_size:
+                self._unlink(shm)
+            else:
+                self._free.append(shm)
+
+    def attach(self, frame: CapFrame, slot: typing.Optional[SlotRef]):
+        """Replace the descriptors of `frame` by in-place views of `slot`.
+
+        The slot is released with the last `frame.release()`, or right away if
+        the worker did not use it.
+        """
+        if slot is None:
+            return
+        shm = self._slots.get(slot.name)
+        shared = []
+        for product, value in list(frame.products.items()):
+            if isinstance(value, SharedArray):
+                frame.products[product] = np.ndarray(value.shape, np.dtype(value.dtype),
+                                                     buffer=shm.buf, offset=value.offset)
+                shared.append(product)
+        if shared:
+            frame.set_release_hook(lambda: self.release(slot.name), shared)
+        else:
+            self.release(slot.name)
+
+    def close(self):
+        """Unlink all slots, slots still leased are unlinked when released."""
+        with self._lock:
+            self._closed = True
+            for shm in self._free:
+                self._unlink(shm)
+            self._free.clear()
+
+    def _unlink(self, shm: shared_memory.SharedMemory):
+        self._slots.pop(shm.name, None)
+        try:
+            shm.close()
+        except BufferError:
+            # a reader kept a view instead of detaching its product
+            logger.warning(f"shared frame slot {shm.name} still referenced")
+        shm.unlink()
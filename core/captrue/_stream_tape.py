@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+
+import json
+import time
+import socket
+import struct
+import typing
+import threading
+
+from logzero import logger
+
+# file header: magic, wall clock time of the first chunk
+_MAGIC = b"HMCAPTAPE\x01"
+_HEADER = struct.Struct("<10sd")
+# one record per recv: seconds since the first chunk, payload length
+_RECORD = struct.Struct("<dI")
+
+
+class TapeWriter:
+    """Write the chunks of a capture stream with their arrival times.
+
+    Example:
+        with TapeWriter("session.tape") as tape:
+            tape.write(chunk)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "wb")
+        self._lock = threading.Lock()
+        self._start: typing.Optional[float] = None
+        self._epoch = 0.0
+        self.chunks = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data: bytes, arrival: float = None):
+        """Append a chunk received at monotonic time `arrival`, default now."""
+        arrival = time.monotonic() if arrival is None else arrival
+        with self._lock:
+            if self._file is None:
+                return
+            if self._start is None:
+                self._start = arrival
+                self._epoch = time.time()
+                self._file.write(_HEADER.pack(_MAGIC, self._epoch))
+            self._file.write(_RECORD.pack(arrival - self._start, len(data)))
+            self._file.write(data)
+            self.chunks += 1
+            self.bytes += len(data)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        logger.debug(f"capture tape {self.path}: {self.chunks} chunks, {self.bytes} bytes")
+
+
+def read_tape(path: str) -> typing.Iterator[typing.Tuple[float, bytes]]:
+    """Yield (seconds since the first chunk, chunk) from a tape written by TapeWriter.
+
+    Raises:
+        ValueError: Not a capture tape.
+    """
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if not header:
+            return
+        if len(header) < _HEADER.size or _HEADER.unpack(header)[0] != _MAGIC:
+            raise ValueError(f"{path} is not a capture tape")
+        while True:
+            record = f.read(_RECORD.size)
+            if len(record) < _RECORD.size:
+                return
+            offset, size = _RECORD.unpack(record)
+            data = f.read(size)
+            if len(data) < size:
+                logger.warning(f"capture tape {path} is truncated")
+                return
+            yield offset, data
+
+
+class StreamTap:
+    """Socket wrapper saving everything read with `recv_into` to a tape.
+
+    Only the capture stream is read with `recv_into`, replies to commands
+    are read with `recv` and are not recorded. Other attributes are those
+    of the wrapped socket.
+    """
+
+    def __init__(self, sock, path: str):
+        self._sock = sock
+        self.tape = TapeWriter(path)
+
+    def __getattr__(self, name):
+        if name == "_sock":
+            raise AttributeError(name)
+        return getattr(self._sock, name)
+
+    def recv_into(self, buffer, *args) -> int:
+        n = self._sock.recv_into(buffer, *args)
+        if n:
+            self.tape.write(bytes(memoryview(buffer)[:n]))
+        return n
+
+    def close(self):
+        self.tape.close()
+        self._sock.close()
+
+
+class ReplaySocket:
+    """Stand-in for the Captures socket playing back a tape.
+
+    Commands sent with `sendall` are answered like the uitest agent does,
+    the recorded stream is read with `recv_into`. With `realtime` every chunk
+    is held back until its original arrival time divided by `speed`,
+    otherwise the tape is read as fast as the pipeline consumes it. The
+    stream ends (recv_into returns 0) at the end of the tape, or after
+    `loops` passes.
+    """
+
+    def __init__(self, path: str, realtime: bool = True, speed: float = 1.0, loops: int = 1):
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self.loops = loops
+        self._timeout: typing.Optional[float] = None
+        self._replies: typing.List[bytes] = []
+        self._chunks: typing.Optional[typing.Iterator[typing.Tuple[float, bytes]]] = None
+        self._pending: typing.Optional[typing.Tuple[float, bytes]] = None
+        self._chunk = memoryview(b"")
+        self._start = 0.0
+        self._closed = False
+        self.replayed_bytes = 0
+
+    def settimeout(self, timeout: typing.Optional[float]):
+        self._timeout = timeout
+
+    def connect(self, address):
+        pass
+
+    def sendall(self, data: bytes):
+        for line in bytes(data).splitlines():
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            if msg.get("method") == "Captures":
+                self._replies.append(b'{"result":true}')
+            else:
+                self._replies.append(b'{"result":null}')
+
+    def recv(self, size: int) -> bytes:
+        if self._replies:
+            return self._replies.pop(0)[:size]
+        view = memoryview(bytearray(size))
+        return bytes(view[:self.recv_into(view)])
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        if self._closed:
+            return 0
+        if not self._chunk:
+            if not self._next_chunk():
+                return 0
+        view = memoryview(buffer)
+        size = min(len(self._chunk), nbytes or len(view))
+        view[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        self.replayed_bytes += size
+        return size
+
+    def close(self):
+        self._closed = True
+
+    def _passes(self) -> typing.Iterator[typing.Tuple[float, bytes]]:
+        duration = 0.0
+        for index in range(self.loops):
+            last = 0.0
+            for offset, data in read_tape(self.path):
+                last = offset
+                yield duration + offset, data
+            # keep the pace across passes
+            duration += last
+        logger.debug(f"end of capture tape {self.path}")
+
+    def _next_chunk(self) -> bool:
+        if self._chunks is None:
+            self._chunks = self._passes()
+            self._start = time.monotonic()
+        if self._pending is None:
+            self._pending = next(self._chunks, None)
+            if self._pending is None:
+                return False
+        offset, data = self._pending
+        if self.realtime:
+            delay = self._start + offset / self.speed - time.monotonic()
+            if self._timeout is not None and delay > self._timeout:
+                # like an idle socket, the reader checks its stop event and comes back
+                time.sleep(self._timeout)
+                raise socket.timeout("timed out")
+            if delay > 0:
+                time.sleep(delay)
+        self._pending = None
+        self._chunk = memoryview(data)
+        return True
@@ -13,20 +13,27 @@ from functools import cached_property # python3.8+
 from core.hmdriver2.protocol import HypiumResponse, CommandResult, KeyCode, DisplayRotation, DeviceInfo, Point
 from core.hmdriver2.utils import delay
 from core.hmdriver2._driver import HmDriver
-from core.captrue import CapObserver, CapSubscriber, ScreenRecorder
+from core.captrue import CapObserver, CapSubscriber, ScreenRecorder, InstantReplay, DEFAULT_RENDITION, OverflowPolicy
 
 class HmDevice:
     _instance: Dict = {}
     
-    def __init__(self, serial: str):
+    def __init__(self, serial: str, passthrough: bool = False, renditions: Dict = None, workers: int = None,
+                 record_stream: str = None, profile: bool = False):
         self.serial = serial
         self._driver = HmDriver(serial)
-        self._cap_observer = CapObserver(serial)
-        self._cap_subscriber = CapSubscriber()
+        self._cap_observer = CapObserver(serial, renditions=renditions, workers=workers,
+                                         record_stream=record_stream, profile=profile)
+        # passthrough streams the device JPEG, nothing gets decoded unless a recorder is running
+        self._default_rendition = "raw" if passthrough else DEFAULT_RENDITION
+        # readers are subscribed on first use, a rendition nobody reads is not computed
+        self._cap_subscriber: CapSubscriber = None
+        self._cap_readers: Dict[str, CapSubscriber] = {}
+        self._cap_reader_refs: Dict[str, int] = {}
         self.hdc = self._driver.hdc
         self._init_driver()
 
-    def __new__(cls: Type[Any], serial: str) -> Any:
+    def __new__(cls: Type[Any], serial: str, *args, **kwargs) -> Any:
         """
         Ensure that only one instance of Driver exists per device serial number.
         """
@@ -34,6 +41,17 @@ class HmDevice:
             cls._instance[serial] = super().__new__(cls)
         return cls._instance[serial]
 
+    def release(self):
+        """Stop the capture and close the driver connection, HmDevice(serial) afterwards starts over."""
+        if self._cap_observer:
+            self._cap_observer.release()
+            self._cap_observer = None
+        if self._driver:
+            self._driver.release()
+            self._driver = None
+        if HmDevice._instance.get(self.serial) is self:
+            del HmDevice._instance[self.serial]
+
     def __del__(self):
         if hasattr(self, '_driver') and self._driver:
             self._driver.release()
@@ -44,7 +62,6 @@ class HmDevice:
         """init driver"""
         self._driver.start()
         
-        self._cap_observer.subscribe(self._cap_subscriber)
         self._cap_observer.start()
         logger.debug("_cap_observer started")
         
@@ -146,14 +163,23 @@ class HmDevice:
             logger.error(f"An error occurred:{e}")
         return app_info
 
-    def start_screen_recorder(self, video_path: str):
+    def start_screen_recorder(self, video_path: str, raw: bool = False, fps: float = 10,
+                              overflow: OverflowPolicy = OverflowPolicy.DROP):
         """start screen recorder
 
         Args:
             video_path (str): _description_
+            raw (bool, optional): Record the device JPEG frames into an MJPEG AVI without
+                transcoding. Default is False.
+            fps (float, optional): Frame rate of the mp4v recording. Default is 10.
+            overflow (OverflowPolicy, optional): What to do when the encoder process falls
+                behind, see `ScreenRecorder.stats` for the drop counters. Default is DROP.
+
+        Returns:
+            ScreenRecorder: its `video_paths` have timestamp sidecars for `RecordingIndex`.
         """
         
-        sr = ScreenRecorder(video_path)
+        sr = ScreenRecorder(video_path, raw=raw, fps=fps, overflow=overflow)
         self._cap_observer.subscribe(sr)
         sr.start()
         return sr
@@ -164,8 +190,28 @@ class HmDevice:
         """stop screen recorder"""
         if sr is None:
             return
-        sr.stop()
+        # unsubscribing delivers the frames still in its mailbox, stop then flushes the encoder
         self._cap_observer.unsubscribe(sr)
+        sr.stop()
+
+    def start_instant_replay(self, seconds: float = 60, max_bytes: int = 64 * 1024 * 1024):
+        """keep the last `seconds` of the screen in memory, save them with `save_last`
+
+        Args:
+            seconds (float, optional): Time window kept in memory. Default is 60.
+            max_bytes (int, optional): Memory for JPEG data at most. Default is 64 MiB.
+        """
+        replay = InstantReplay(seconds, max_bytes)
+        self._cap_observer.subscribe(replay)
+        return replay
+
+    def stop_instant_replay(self, replay):
+        """stop instant replay and free its buffer"""
+        if replay is None:
+            return
+        if self._cap_observer is not None and replay in self._cap_observer.subscribers:
+            self._cap_observer.unsubscribe(replay)
+        replay.release()
     
     @delay
     def go_back(self):
@@ -234,7 +280,65 @@ class HmDevice:
 
     @property
     def cap_reader(self) -> CapSubscriber:
+        """Frame reader of the default rendition, subscribed on first access for the device lifetime."""
+        if self._cap_subscriber is None:
+            self._cap_subscriber = self.cap_reader_for()
         return self._cap_subscriber
+
+    @property
+    def capturing(self) -> bool:
+        """False once the screen capture stopped or the device closed the stream."""
+        return self._cap_observer is not None and self._cap_observer.capturing
+
+    @property
+    def renditions(self) -> Dict:
+        """Renditions available to `cap_reader_for`."""
+        return self._cap_observer.renditions
+
+    def capture_stats(self) -> Dict:
+        """Capture profile (empty unless profiling) and per-subscriber delivery counters."""
+        return {
+            "capture": self._cap_observer.stats(),
+            "delivery": self._cap_observer.delivery_stats(),
+        }
+
+    def cap_reader_for(self, rendition: str = None) -> CapSubscriber:
+        """Get the frame reader of a rendition, subscribing it on first use.
+
+        Readers are shared and reference counted, pair every call with
+        `release_cap_reader`.
+
+        Args:
+            rendition (str, optional): rendition name, see CapObserver.renditions.
+                Default is the rendition of `cap_reader`.
+
+        Raises:
+            KeyError: Unknown rendition name.
+        """
+        rendition = rendition or self._default_rendition
+        if rendition not in self._cap_readers:
+            reader = CapSubscriber(self._cap_observer.rendition(rendition))
+            self._cap_readers[rendition] = reader
+            self._cap_reader_refs[rendition] = 0
+            self._cap_observer.subscribe(reader)
+        self._cap_reader_refs[rendition] += 1
+        return self._cap_readers[rendition]
+
+    def release_cap_reader(self, reader: CapSubscriber):
+        """Drop a reference taken by `cap_reader_for`, the last one unsubscribes the reader."""
+        for rendition, subscribed in self._cap_readers.items():
+            if subscribed is reader:
+                break
+        else:
+            return
+        self._cap_reader_refs[rendition] -= 1
+        if self._cap_reader_refs[rendition] > 0:
+            return
+        del self._cap_readers[rendition]
+        del self._cap_reader_refs[rendition]
+        if self._cap_observer is not None:
+            self._cap_observer.unsubscribe(reader)
+        reader.release()
     
     @cached_property
     def gesture(self):
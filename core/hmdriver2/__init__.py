@@ -1,3 +1,4 @@
 from ._driver import HmDriver
 from ._gesture import _Gesture as Gesture 
+from ._emulator import UitestEmulator, emulator_serial
 from .exception import * 
@@ -16,6 +16,7 @@ from functools import cached_property
 from logzero import logger
 
 from .hdc import HdcWrapper
+from ._emulator import EmulatorHdc, is_emulator
 from .protocol import HypiumResponse, DriverData
 from .exception import InvokeHypiumError, InvokeCaptures
 
@@ -25,7 +26,7 @@ SOCKET_TIMEOUT = 20
 
 class HmDriver:
     def __init__(self, serial: str):
-        self.hdc = HdcWrapper(serial)
+        self.hdc = EmulatorHdc(serial) if is_emulator(serial) else HdcWrapper(serial)
         self.sock = None
         
     @cached_property
@@ -38,11 +39,14 @@ class HmDriver:
         logger.debug("rm fport local port")
         self.hdc.rm_fport(self.local_port, UITEST_SERVICE_PORT)
 
+    @property
+    def local_host(self) -> str:
+        """Host of the forwarded uitest port, an emulator may run on another machine."""
+        return self.hdc.host if isinstance(self.hdc, EmulatorHdc) else "127.0.0.1"
+
     def _connect_sock(self):
         """Create socket and connect to the uiTEST server."""
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(SOCKET_TIMEOUT)
-        self.sock.connect((("127.0.0.1", self.local_port)))
+        self.sock = socket.create_connection((self.local_host, self.local_port), timeout=SOCKET_TIMEOUT)
         
     def _send_msg(self, msg: typing.Dict):
         """Send an message to the server.
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# require: python >= 3.8
+#
+# Local stand-in for the on-device uitest daemon, for load tests without hardware.
+#
+# usage: python -m core.hmdriver2._emulator [--port 8012] [--width 1080] [--height 2340] [--fps 30]
+#        python example.py -s emulator:127.0.0.1:8012
+
+import json
+import time
+import random
+import socket
+import typing
+import argparse
+import threading
+import collections
+import socketserver
+
+import cv2
+import numpy as np
+from logzero import logger
+
+from .hdc import HdcWrapper
+from .protocol import CommandResult
+
+EMULATOR_PREFIX = "emulator:"
+
+
+def is_emulator(serial: str) -> bool:
+    return serial.startswith(EMULATOR_PREFIX)
+
+
+def emulator_serial(host: str, port: int) -> str:
+    """Serial that makes HmDriver connect to the emulator at host:port."""
+    return f"{EMULATOR_PREFIX}{host}:{port}"
+
+
+def synthetic_frames(width: int, height: int, count: int, quality: int = 80) -> typing.List[bytes]:
+    """Encode `count` screens with a moving bar and a frame counter."""
+    base = np.full((height, width, 3), 245, np.uint8)
+    cv2.rectangle(base, (0, 0), (width, height // 14), (200, 120, 40), -1)
+    bar = max(8, height // 20)
+    frames = []
+    for i in range(count):
+        img = base.copy()
+        y = height // 14 + (height - height // 14 - bar) * i // max(count, 1)
+        cv2.rectangle(img, (0, y), (width, y + bar), (60, 60, 60), -1)
+        cv2.putText(img, f"{i:04d}", (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    width / 300, (30, 30, 200), max(1, width // 200))
+        _, jpeg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        frames.append(jpeg.tobytes())
+    return frames
+
+
+class UitestEmulator:
+    """TCP server speaking the hypium JSON protocol of the uitest daemon.
+
+    `callHypiumApi` requests get the replies the daemon would give for the
+    driver, gesture and input APIs used here, and the latest requests are
+    kept in `calls`. `Captures.startCaptureScreen` streams synthetic JPEG frames at
+    `fps` until `stopCaptureScreen` or disconnect. Replies are delayed by
+    `latency` seconds, replies and frame intervals by up to +-`jitter`.
+
+    Example:
+        with UitestEmulator(width=720, height=1280, fps=60) as emulator:
+            d = HmDevice(emulator.serial)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, width: int = 1080, height: int = 2340,
+                 fps: float = 30, latency: float = 0.0, jitter: float = 0.0, quality: int = 80,
+                 distinct_frames: int = 30):
+        """
+        Args:
+            host (str, optional): Listen address. Default is 127.0.0.1.
+            port (int, optional): Listen port, 0 picks a free one. Default is 0.
+            width (int, optional): Display width. Default is 1080.
+            height (int, optional): Display height. Default is 2340.
+            fps (float, optional): Capture frame rate. Default is 30.
+            latency (float, optional): Seconds before each reply. Default is 0.0.
+            jitter (float, optional): Random extra +- seconds on replies and frame intervals. Default is 0.0.
+            quality (int, optional): JPEG quality of the frames. Default is 80.
+            distinct_frames (int, optional): Frames encoded up front and streamed in a loop. Default is 30.
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.latency = latency
+        self.jitter = jitter
+        self.frames = synthetic_frames(width, height, distinct_frames, quality)
+        self.calls: typing.Deque[typing.Tuple[str, list]] = collections.deque(maxlen=10000)
+        self.frames_sent = 0
+        self._objects = 0
+        self._lock = threading.Lock()
+
+        emulator = self
+
+        class _Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                _Session(emulator, self.request).run()
+
+        self._server = socketserver.ThreadingTCPServer((host, port), _Handler, bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.allow_reuse_address = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def address(self) -> typing.Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    @property
+    def serial(self) -> str:
+        return emulator_serial(*self.address)
+
+    def start(self) -> "UitestEmulator":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"uitest emulator listening on {self.address[0]}:{self.address[1]}, "
+                    f"{self.width}x{self.height} @ {self.fps} fps")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def delay(self, base: float):
+        """Sleep `base` seconds plus jitter."""
+        delay = base + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def call(self, api: str, this: typing.Optional[str], args: list) -> typing.Dict:
+        """Reply to a callHypiumApi request."""
+        with self._lock:
+            self.calls.append((api, args))
+            if api == "Driver.create":
+                return {"result": "Driver#0"}
+            if api == "Driver.getDisplaySize":
+                return {"result": {"x": self.width, "y": self.height}}
+            if api == "Driver.getDisplayRotation":
+                return {"result": 0}
+            if api in ("PointerMatrix.create", "By.text", "On.text"):
+                self._objects += 1
+                return {"result": f"{api.split('.')[0]}#{self._objects}"}
+            if api == "Driver.injectMultiPointerAction":
+                return {"result": True}
+            if api.startswith(("Driver.", "PointerMatrix.")):
+                return {"result": None}
+        return {"exception": {"code": 401, "message": f"(PreProcessing: APiCallInfoChecker)Api {api} not found"}}
+
+
+class _Session:
+    """One client connection, replies and the capture stream share the socket."""
+
+    def __init__(self, emulator: UitestEmulator, sock: socket.socket):
+        self.emulator = emulator
+        self.sock = sock
+        self._send_lock = threading.Lock()
+        self._capturing = threading.Event()
+        self._closed = threading.Event()
+
+    def run(self):
+        buffer = b""
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        self._on_message(json.loads(line))
+        except (OSError, ValueError) as e:
+            logger.debug(f"uitest emulator session closed: {e}")
+        finally:
+            self._closed.set()
+            self._capturing.clear()
+
+    def _send(self, data: bytes):
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def _reply(self, reply: typing.Dict):
+        self.emulator.delay(self.emulator.latency)
+        self._send(json.dumps(reply, separators=(',', ':')).encode('utf-8'))
+
+    def _on_message(self, msg: typing.Dict):
+        params = msg.get("params", {})
+        api = params.get("api", "")
+        if msg.get("method") == "Captures":
+            if api == "startCaptureScreen":
+                self._reply({"result": True})
+                if not self._capturing.is_set():
+                    self._capturing.set()
+                    threading.Thread(target=self._stream, daemon=True).start()
+            elif api == "stopCaptureScreen":
+                self._capturing.clear()
+                self._reply({"result": True})
+            else:
+                self._reply({"exception": {"code": 401, "message": f"Captures {api} not supported"}})
+        else:
+            self._reply(self.emulator.call(api, params.get("this"), params.get("args", [])))
+
+    def _stream(self):
+        emulator = self.emulator
+        interval = 1.0 / emulator.fps
+        index = 0
+        # the first frame comes one interval after the reply, like on a device
+        deadline = time.monotonic()
+        try:
+            while True:
+                deadline += interval
+                emulator.delay(deadline - time.monotonic())
+                if not self._capturing.is_set() or self._closed.is_set():
+                    break
+                self._send(emulator.frames[index % len(emulator.frames)])
+                emulator.frames_sent += 1
+                index += 1
+        except OSError:
+            pass
+
+
+class EmulatorHdc(HdcWrapper):
+    """HdcWrapper for an emulator serial, `host:port` stands in for the forwarded port."""
+
+    def __init__(self, serial: str) -> None:
+        self.serial = serial
+        host, _, port = serial[len(EMULATOR_PREFIX):].rpartition(":")
+        # emulator:[::1]:8012 for an IPv6 address
+        self.host = host.strip("[]") or "127.0.0.1"
+        self.port = int(port)
+
+    def is_online(self) -> bool:
+        try:
+            with socket.create_connection((self.host, self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def forward_port(self, remote_port: int) -> int:
+        return self.port
+
+    def rm_fport(self, local_port: int, remote_port: int) -> int:
+        return local_port
+
+    def list_fports(self) -> typing.List:
+        return []
+
+    def send_file(self, local_path: str, remote_path: str) -> CommandResult:
+        return CommandResult("", "", 0)
+
+    def recv_file(self, remote_path: str, local_path: str) -> CommandResult:
+        return CommandResult("", "", 0)
+
+    def shell(self, cmd: str) -> CommandResult:
+        if "agent.so" in cmd and "echo" in cmd:
+            # not installed, HmDriver then pushes it through send_file
+            return CommandResult("so not exists\n", "", 0)
+        if cmd.startswith("param get"):
+            return CommandResult("emulator\n", "", 0)
+        return CommandResult("", "", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="uitest daemon emulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8012)
+    parser.add_argument("--width", type=int, default=1080)
+    parser.add_argument("--height", type=int, default=2340)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- seconds on replies and frames")
+    parser.add_argument("--quality", type=int, default=80)
+    args = parser.parse_args()
+
+    emulator = UitestEmulator(args.host, args.port, args.width, args.height, args.fps,
+                              args.latency, args.jitter, args.quality)
+    emulator.start()
+    print(f"serial: {emulator.serial}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,49 @@
 # require: python >= 3.8
 
 import argparse
+import asyncio
 import os
+import re
 import json
 import time
+import queue
+import shutil
+import signal
+import socket
+import struct
+import sys
+import typing
+import tempfile
 import threading
-import multiprocessing as mp
+import functools
+import collections
+import urllib.parse
+import concurrent.futures
+import multiprocessing
 from venv import logger
+from datetime import timedelta
+from functools import cached_property
 
+import tornado.escape
+import tornado.gen
+import tornado.httpserver
 import tornado.ioloop
+import tornado.locks
+import tornado.netutil
+import tornado.tcpserver
+import tornado.template
 import tornado.web
+from tornado.iostream import IOStream, StreamClosedError, UnsatisfiableReadError
 from tornado.log import enable_pretty_logging
 from tornado.websocket import WebSocketHandler
 from core.device import HmDevice
+from core.captrue import AdaptiveController, CapSubscriber, rendition_ladder
 from core.hmdriver2 import InjectGestureError
+from core.hmdriver2.hdc import list_targets
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+# --shard workers are spawned, never forked from the running event loop
+_SPAWN = multiprocessing.get_context("spawn")
 
 
 class CorsMixin:
@@ -34,70 +64,605 @@ class CorsMixin:
         self.set_status(204)
         self.finish()
 
-class MainHandler(CorsMixin, tornado.web.RequestHandler):
-    def get(self):
-        self.render("index.html")
+class DeviceSession:
+    """One device of the server, its HmDevice runs while something is connected.
+
+    The first viewer or control connection starts the device, the last one
+    to leave stops it after `linger` seconds so that a page reload does not
+    restart the capture. Broadcasters, input events and viewer statistics
+    belong to the session: an error starting or running one device only
+    fails the requests for that device, and a capture that stopped is
+    restarted by the next connection.
+    """
+
+    def __init__(self, serial: str, linger: float = 5.0, **options):
+        """
+        Args:
+            serial (str): device serial number.
+            linger (float, optional): Seconds the device keeps running without connections. Default is 5.0.
+            options: passed to HmDevice.
+        """
+        self.serial = serial
+        self.linger = linger
+        self.options = options
+        self.device: HmDevice = None
+        self.error: str = None
+        self.connections = 0
+        self.starts = 0
+        # one broadcaster per frame reader, shared by all viewers of that rendition
+        self.broadcasters: dict = {}
+        self.streams: set = set()
+        # latest latency report of each viewer page
+        self.viewer_stats: dict = {}
+        self.events = queue.Queue()
+        # key and back presses block for the @delay of HmDevice, one thread keeps them in order
+        self.input_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f"input-{serial}")
+        self._lock = tornado.locks.Lock()
+        self._stop_timer = None
+
+    @property
+    def state(self) -> str:
+        if self.device is not None:
+            return "running"
+        return "failed" if self.error else "idle"
+
+    async def acquire(self) -> HmDevice:
+        """Count a connection, starting the device if it is not running.
+
+        Raises:
+            tornado.web.HTTPError: 503 if the device cannot be started.
+        """
+        async with self._lock:
+            if self._stop_timer is not None:
+                tornado.ioloop.IOLoop.current().remove_timeout(self._stop_timer)
+                self._stop_timer = None
+            if self.device is not None and not self.device.capturing:
+                logger.warning(f"capture of {self.serial} stopped, restarting the device")
+                await self._stop()
+            if self.device is None:
+                await self._start()
+            self.connections += 1
+            return self.device
+
+    def release(self):
+        """Count a connection out, the last one schedules the stop."""
+        self.connections -= 1
+        if self.connections == 0 and self._stop_timer is None:
+            self._stop_timer = tornado.ioloop.IOLoop.current().call_later(self.linger, self._stop_if_idle)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "connections": self.connections,
+            "starts": self.starts,
+        }
+
+    async def _start(self):
+        logger.info(f"starting device {self.serial}")
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            # connecting the driver and starting the capture takes seconds, keep the loop serving
+            self.device = await loop.run_in_executor(None, functools.partial(HmDevice, self.serial, **self.options))
+            self.error = None
+            self.starts += 1
+        except Exception as e:
+            logger.exception(e)
+            self.error = str(e)
+            raise tornado.web.HTTPError(503, f"device {self.serial} is unavailable: {e}")
+
+    async def _stop_if_idle(self):
+        async with self._lock:
+            self._stop_timer = None
+            if self.connections == 0 and self.device is not None:
+                await self._stop()
+
+    async def _stop(self):
+        logger.info(f"stopping device {self.serial}")
+        device, self.device = self.device, None
+        self.broadcasters.clear()
+        try:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, device.release)
+        except Exception as e:
+            logger.exception(e)
+
+
+class DeviceRegistry:
+    """Device sessions by serial number, discovered with `list_targets`."""
+
+    def __init__(self, serials: list = (), discover: bool = True, **options):
+        """
+        Args:
+            serials (list, optional): devices to serve even if hdc does not list them, e.g.
+                emulators. The first one is served on the routes without a serial.
+            discover (bool, optional): Add the devices listed by `hdc list targets`. Default is True.
+            options: passed to every DeviceSession.
+        """
+        self.default = serials[0] if serials else None
+        self.discover = discover
+        self.options = options
+        self.sessions = {serial: DeviceSession(serial, **options) for serial in serials}
+
+    async def refresh(self):
+        """Add sessions for newly connected devices, running sessions are kept."""
+        if not self.discover:
+            return
+        try:
+            targets = await tornado.ioloop.IOLoop.current().run_in_executor(None, list_targets)
+        except Exception as e:
+            logger.warning(f"device discovery failed: {e}")
+            return
+        for serial in targets:
+            if serial not in self.sessions:
+                logger.info(f"found device {serial}")
+                self.sessions[serial] = DeviceSession(serial, **self.options)
+
+    async def get(self, serial: str = None) -> DeviceSession:
+        """The session of `serial`, or of the default device.
+
+        Raises:
+            tornado.web.HTTPError: 404 if the device is unknown.
+        """
+        serial = serial or self.default
+        if serial is not None and serial not in self.sessions:
+            await self.refresh()
+        if serial not in self.sessions:
+            raise tornado.web.HTTPError(404, f"unknown device {serial}")
+        return self.sessions[serial]
+
+
+class DeviceSessionMixin:
+    """Resolve the device session of a request, /d/<serial>/... or the default device."""
+    REGISTRY: DeviceRegistry = None
+
+    session: DeviceSession = None
+    _acquired = False
+
+    @property
+    def device(self) -> HmDevice:
+        return self.session.device
+
+    async def find_session(self):
+        serial = self.path_args[0] if self.path_args else None
+        self.session = await self.REGISTRY.get(serial)
+
+    async def open_session(self):
+        """Find the session and count this connection, starting the device if needed."""
+        await self.find_session()
+        await self.session.acquire()
+        self._acquired = True
+
+    def close_session(self):
+        if self._acquired:
+            self._acquired = False
+            self.session.release()
+
+
+class MainHandler(CorsMixin, DeviceSessionMixin, tornado.web.RequestHandler):
+    async def get(self, serial: str = None):
+        if serial is None and self.REGISTRY.default is None:
+            self.redirect("/devices")
+            return
+        await self.find_session()
+        base = "/d/" + tornado.escape.url_escape(self.session.serial, plus=False) if serial else ""
+        self.render("index.html", base=base)
+
+
+class DevicesHandler(CorsMixin, DeviceSessionMixin, tornado.web.RequestHandler):
+    async def get(self):
+        await self.REGISTRY.refresh()
+        sessions = sorted(self.REGISTRY.sessions.values(), key=lambda session: session.serial)
+        if "json" in self.request.headers.get("Accept", "") or self.get_argument("format", None) == "json":
+            self.write({session.serial: session.stats() for session in sessions})
+        else:
+            self.render("devices.html", sessions=sessions, url_escape=tornado.escape.url_escape)
+
+# binary /stream message header: sequence number, capture and send time (ms since epoch), JPEG size
+FRAME_HEADER = struct.Struct("<IddI")
+
+
+class BroadcastFrame:
+    """A frame handed to the viewers of a broadcaster.
+
+    The headers that do not change are built once, the send time is stamped
+    on every write so a viewer that gets the frame late measures the delay.
+    """
+
+    def __init__(self, seq: int, jpeg: bytes, stamps: dict):
+        self.seq = seq
+        self.jpeg = jpeg
+        self.stamps = stamps
+
+    @cached_property
+    def _part_head(self) -> str:
+        """Part boundary and headers with the sequence number and stage times (ms since epoch)."""
+        timestamps = "".join(f"{stage}={stamp * 1000:.1f}," for stage, stamp in self.stamps.items())
+        return (f"--frame\r\n"
+                f"Content-Type: image/jpeg\r\n"
+                f"Content-Length: {len(self.jpeg)}\r\n"
+                f"X-Frame-Seq: {self.seq}\r\n"
+                f"X-Frame-Timestamps: {timestamps}")
+
+    def mjpeg_head(self) -> bytes:
+        """Headers of the multipart part sent now, the JPEG and a CRLF follow."""
+        return f"{self._part_head}send={time.time() * 1000:.1f}\r\n\r\n".encode()
+
+    def ws_message(self) -> bytes:
+        """Binary /stream message sent now, FRAME_HEADER and the JPEG."""
+        return FRAME_HEADER.pack(self.seq & 0xFFFFFFFF, self.stamps.get("split", 0.0) * 1000,
+                                 time.time() * 1000, len(self.jpeg)) + self.jpeg
+
+
+class FrameBroadcaster:
+    """Hand each new frame of one frame reader to all its viewers.
+
+    One coroutine on the IOLoop sleeps until the capture publishes a newer
+    frame and passes the same `BroadcastFrame` to every viewer, /mjpeg and
+    /stream alike, so a viewer costs a buffer append per frame and no thread.
+    A new viewer gets the latest frame right away. The coroutine runs while
+    there are viewers.
+    """
+
+    def __init__(self, name: str, reader: CapSubscriber):
+        self.name = name
+        self.reader = reader
+        self.viewers = set()
+        self.seq = -1
+        self.frames = 0
+        self.last: BroadcastFrame = None
+        self._running = False
+
+    def add(self, viewer):
+        self.viewers.add(viewer)
+        if self._running:
+            if self.last is not None:
+                viewer.send_frame(self.last)
+        else:
+            # the first wait returns the latest frame to everyone
+            self.seq = -1
+            self.last = None
+            self._running = True
+            tornado.ioloop.IOLoop.current().spawn_callback(self._run)
+
+    def remove(self, viewer):
+        self.viewers.discard(viewer)
+
+    def stats(self) -> dict:
+        return {"viewers": len(self.viewers), "frames": self.frames}
+
+    async def _run(self):
+        try:
+            while self.viewers:
+                # sleeps until the capture thread publishes a newer frame
+                content = await self.reader.wait_frame_async(self.seq, timeout=1.0)
+                if content is None:
+                    if self.reader.latest.closed:
+                        for viewer in list(self.viewers):
+                            viewer.close_stream()
+                        break
+                    continue
+                self.seq, frame, stamps = content
+                self.last = BroadcastFrame(self.seq, bytes(frame), stamps)
+                self.frames += 1
+                for viewer in list(self.viewers):
+                    viewer.send_frame(self.last)
+        finally:
+            self._running = False
+
+
+class BroadcastViewerMixin(DeviceSessionMixin):
+    """Join the broadcaster of a rendition, shared by /mjpeg and /stream viewers."""
+
+    cap_reader: CapSubscriber = None
+    rendition: str = None
+    controller: AdaptiveController = None
+    _broadcaster: FrameBroadcaster = None
+
+    def select_rendition(self):
+        """Pick the frame reader of the `r` argument, "auto" adapts to the viewer."""
+        rendition = self.get_argument("r", None)
+        logger.info(f"Request from {self.request.remote_ip}, rendition {rendition}")
+        if rendition == "auto":
+            # follow the viewer's flush latency along the rendition ladder
+            self.controller = AdaptiveController(rendition_ladder(self.device.renditions))
+            rendition = self.controller.rendition
+        try:
+            self.cap_reader = self.device.cap_reader_for(rendition)
+            self.rendition = rendition or "default"
+        except KeyError as e:
+            raise tornado.web.HTTPError(400, str(e))
+
+    def join(self, reader: CapSubscriber):
+        self.leave()
+        broadcasters = self.session.broadcasters
+        if reader not in broadcasters:
+            broadcasters[reader] = FrameBroadcaster(self.rendition, reader)
+        self._broadcaster = broadcasters[reader]
+        self._broadcaster.add(self)
+
+    def leave(self):
+        broadcaster, self._broadcaster = self._broadcaster, None
+        if broadcaster is None:
+            return
+        broadcaster.remove(self)
+        broadcasters = self.session.broadcasters
+        if not broadcaster.viewers and broadcasters.get(broadcaster.reader) is broadcaster:
+            del broadcasters[broadcaster.reader]
+
+    def release_rendition(self):
+        """Leave the broadcaster and give back the frame reader, the last viewer unsubscribes it."""
+        self.leave()
+        reader, self.cap_reader = self.cap_reader, None
+        if reader is not None and self.device is not None:
+            self.device.release_cap_reader(reader)
+
+    def adapt(self, started):
+        rendition = self.controller.rendition
+        self.controller.on_flush(started)
+        if self.controller.rendition != rendition:
+            logger.info(f"viewer {self.request.remote_ip} switched to {self.controller.rendition}, "
+                        f"interval {self.controller.interval:.3f}s, latency {self.controller.latency:.3f}s")
+            reader = self.cap_reader
+            self.cap_reader = self.device.cap_reader_for(self.controller.rendition)
+            self.rendition = self.controller.rendition
+            self.join(self.cap_reader)
+            self.device.release_cap_reader(reader)
+
+
+class MJPEGHandler(BroadcastViewerMixin, CorsMixin, tornado.web.RequestHandler):
+    """Frames as a multipart MJPEG stream.
+
+    At most one frame is being flushed to the viewer. A frame arriving
+    meanwhile waits as the pending frame and a newer one replaces it, so a
+    slow link skips frames instead of piling them up in Tornado's buffers.
+    """
 
-class MJPEGHandler(CorsMixin, tornado.web.RequestHandler):
-    CAP_READER = None
-    LAST_FRAME = None
-    
     def __init__(self, application, request, **kwargs):
         super().__init__(application, request, **kwargs)
-        self.stop_event = threading.Event()
-        self.read_frame_th = threading.Thread(target=self._read_frame)
-        self.read_frame_th.daemon = True
-        self.read_frame_th.start()
+        self._closed = tornado.locks.Event()
+        self._flushing = False
+        self._pending: BroadcastFrame = None
+        self._timer = None
+        self._due = 0.0
+        self.sent = 0
+        self.skipped = 0
+        self.buffered = 0           # bytes written and not flushed yet
     
-    def prepare(self):
-        client_ip = self.request.remote_ip
-        logger.info(f"Request from {client_ip}")
+    async def prepare(self):
+        await self.open_session()
+        self.select_rendition()
     
-    @tornado.gen.coroutine
-    def get(self):
+    async def get(self, serial: str = None):
         self.set_header("Content-type", "multipart/x-mixed-replace;boundary=--frame")
-        while True:
-            try:                    
-                if self.LAST_FRAME is not None:
-                    self.write(b'--frame\r\n')
-                    self.write(b'Content-Type: image/jpeg\r\n\r\n' + bytearray(self.LAST_FRAME) + b'\r\n')
-                    logger.debug("flush frame")
-                    yield self.flush()
-                else:
-                    logger.debug("no frame")
-            except Exception as e:
-                pass
-            yield tornado.gen.sleep(0.05)    
-            
-    def _read_frame(self):
-        while True:
-            try:
-                frame = self.CAP_READER.get_content()
-                if frame is not None:
-                    self.LAST_FRAME = frame
-            except Exception as e:
-                pass
-            time.sleep(0.05)
+        self.session.streams.add(self)
+        self.join(self.cap_reader)
+        # the broadcaster writes the frames, wait for the viewer or the capture to go away
+        await self._closed.wait()
+
+    def on_connection_close(self):
+        logger.info(f"viewer {self.request.remote_ip} disconnected")
+        self.close_stream()
+
+    def on_finish(self):
+        if self.session is not None:
+            self.session.streams.discard(self)
+            self.release_rendition()
+        self.close_session()
+
+    def close_stream(self):
+        self.leave()
+        if self._timer is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._timer)
+            self._timer = None
+        self._pending = None
+        self._closed.set()
+
+    def send_frame(self, frame: BroadcastFrame) -> bool:
+        """Write a frame part, or keep it pending while the previous one is being flushed.
+
+        Returns:
+            bool: False if the stream is closed.
+        """
+        if self._closed.is_set():
+            return False
+        if self._pending is not None:
+            self.skipped += 1
+        self._pending = frame
+        self._write_pending()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "transport": "mjpeg",
+            "viewer": self.request.remote_ip,
+            "rendition": self.rendition,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "buffered": self.buffered,
+            "pending": self._pending is not None,
+        }
+
+    def _write_pending(self):
+        if self._flushing or self._pending is None or self._closed.is_set():
+            return
+        delay = self._due - time.monotonic() if self.controller is not None else 0
+        if delay > 0:
+            if self._timer is None:
+                self._timer = tornado.ioloop.IOLoop.current().call_later(delay, self._on_due)
+            return
+        frame, self._pending = self._pending, None
+        head = frame.mjpeg_head()
+        self.write(head)
+        self.write(frame.jpeg)
+        self.write(b'\r\n')
+        started = self.controller.on_write(len(frame.jpeg)) if self.controller is not None else None
+        self.sent += 1
+        self.buffered = len(head) + len(frame.jpeg) + 2
+        self._flushing = True
+        self.flush().add_done_callback(functools.partial(self._on_flushed, started))
+
+    def _on_due(self):
+        self._timer = None
+        self._write_pending()
 
+    def _on_flushed(self, started, future):
+        self._flushing = False
+        self.buffered = 0
+        if future.exception() is not None:
+            # StreamClosedError, the viewer is gone
+            self.close_stream()
+            return
+        if self.controller is not None:
+            self.adapt(started)
+            self._due = time.monotonic() + self.controller.interval
+        self._write_pending()
 
-class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
+
+class FrameStreamHandler(BroadcastViewerMixin, CorsMixin, WebSocketHandler):
+    """Frames as binary WebSocket messages, a `FRAME_HEADER` followed by the JPEG.
+
+    The page acks each frame it has drawn with {"action": "ack", "seq": n}.
+    At most `window` frames are unacked, frames arriving meanwhile are
+    skipped and the latest one is sent as soon as an ack frees the window,
+    so delivery follows the pace of the browser instead of piling up in
+    socket buffers. With ?r=auto the ack time drives the AdaptiveController.
+    """
+
+    def initialize(self, window: int = 1):
+        self.window = window
+        self._unacked = collections.OrderedDict()
+        self._last_sent = -1
+        self._due = 0.0
+        self._timer = None
+        self._waiting = False
+        self.sent = 0
+        self.skipped = 0
+        self.acked = 0
+        self.ack_latency = 0.0      # smoothed seconds from send to ack
+
+    def check_origin(self, origin):
+        return True
+
+    async def prepare(self):
+        await self.find_session()
+
+    async def open(self, serial: str = None):
+        try:
+            await self.open_session()
+            self.select_rendition()
+        except tornado.web.HTTPError as e:
+            logger.error(f"frame stream {self.request.remote_ip}: {e.log_message}")
+            self.close(1011, e.log_message)
+            return
+        logger.info(f"frame stream {self.request.remote_ip} opened, rendition {self.rendition}")
+        self.session.streams.add(self)
+        self.join(self.cap_reader)
+
+    def on_close(self):
+        logger.info(f"frame stream {self.request.remote_ip} closed")
+        if self._timer is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._timer)
+            self._timer = None
+        self.session.streams.discard(self)
+        self.release_rendition()
+        self.close_session()
+
+    def close_stream(self):
+        self.leave()
+        self.close()
+
+    def on_message(self, message):
+        msg = json.loads(message)
+        if msg.get('action') != 'ack':
+            return
+        seq = msg.get('seq')
+        if seq not in self._unacked:
+            return
+        # an ack also covers the frames sent before it
+        while self._unacked:
+            sent_seq, (sent, started) = self._unacked.popitem(last=False)
+            if sent_seq == seq:
+                break
+        self.acked += 1
+        self.ack_latency += (time.monotonic() - sent - self.ack_latency) * 0.2
+        if self.controller is not None:
+            self.adapt(started)
+            self._due = time.monotonic() + self.controller.interval
+        # catch up with the frame skipped while the window was full
+        self._send_last()
+
+    def _on_due(self):
+        self._timer = None
+        self._send_last()
+
+    def _send_last(self):
+        if self._broadcaster is not None and self._broadcaster.last is not None:
+            self.send_frame(self._broadcaster.last)
+
+    def send_frame(self, frame: BroadcastFrame) -> bool:
+        """Send a frame unless the window is full or it was sent already.
+
+        Returns:
+            bool: False if the frame was skipped.
+        """
+        if self.ws_connection is None or self.ws_connection.is_closing() or frame.seq <= self._last_sent:
+            return False
+        delay = self._due - time.monotonic() if self.controller is not None else 0
+        if len(self._unacked) >= self.window or delay > 0:
+            # the latest frame goes out with the next ack or when due, count the ones it replaces
+            if self._waiting:
+                self.skipped += 1
+            self._waiting = True
+            if len(self._unacked) < self.window and self._timer is None:
+                self._timer = tornado.ioloop.IOLoop.current().call_later(delay, self._on_due)
+            return False
+        self._waiting = False
+        started = self.controller.on_write(len(frame.jpeg)) if self.controller is not None else None
+        self._unacked[frame.seq] = (time.monotonic(), started)
+        self._last_sent = frame.seq
+        self.sent += 1
+        self.write_message(frame.ws_message(), binary=True)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "transport": "ws",
+            "viewer": self.request.remote_ip,
+            "rendition": self.rendition,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "acked": self.acked,
+            "unacked": len(self._unacked),
+            "ack_latency": self.ack_latency,
+        }
+
+
+class MiniTouchWSHandler(DeviceSessionMixin, CorsMixin, WebSocketHandler):
     
-    DEVICE: HmDevice = None
-    EVETS_QUEUE: mp.Queue = mp.Queue()
     LAST_GESTURE = None
     
     def initialize(self):
+        self.io_loop = tornado.ioloop.IOLoop.current()
         self.last_event_time = 0
         self.stop_event = threading.Event()
         self.mouse_events_th = threading.Thread(target=self.on_mouse_event)
         self.mouse_events_th.daemon = True
-        self.mouse_events_th.start()
     
     def check_origin(self, origin):
         return True
+
+    async def prepare(self):
+        await self.find_session()
     
-    def open(self):
+    async def open(self, serial: str = None):
+        try:
+            await self.open_session()
+        except tornado.web.HTTPError as e:
+            logger.error(f"minitouch {self.request.remote_ip}: {e.log_message}")
+            self.close(1011, e.log_message)
+            return
         logger.info("connection created")
+        self.mouse_events_th.start()
     
     def on_message(self, message):
         logger.info(f"Received message: {message}")
@@ -107,18 +672,43 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
         data = msg.get('data')
         if action == 'ping':
             self.send_pong(client_time)
+        elif action == 'stats':
+            self.session.viewer_stats[f"{self.request.remote_ip}#{id(self)}"] = data
+            logger.info(f"viewer latency: {data}")
         elif action == 'back':
-            self.DEVICE.go_back()
+            self.send_input(client_time, self.device.go_back)
         elif action == 'key':
             key = data.get('key')
             logger.info("press key: " + key)
-            self.DEVICE.press_key_ex(key)
+            self.send_input(client_time, self.device.press_key_ex, key)
         else:
             self.add_mouse_event(action, client_time, data)
         
     def on_close(self):
         logger.info("connection closed")
+        self.stop_event.set()
+        self.session.viewer_stats.pop(f"{self.request.remote_ip}#{id(self)}", None)
+        self.close_session()
         
+    def send_input(self, client_time, func, *args):
+        """Run a device input off the IOLoop, the @delay calls sleep and other devices share the loop.
+
+        The session's input thread keeps keys and back presses in order.
+        """
+        def run():
+            dispatched = time.time()
+            func(*args)
+            return dispatched
+
+        def done(future):
+            try:
+                self.send_input_ack(client_time, future.result())
+            except Exception as e:
+                logger.exception(e)
+
+        future = self.io_loop.run_in_executor(self.session.input_executor, run)
+        self.io_loop.add_future(future, done)
+
     def send_pong(self, client_time):
         server_time = int(time.time() * 1000)
         self.write_message(json.dumps({
@@ -127,8 +717,23 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
             'st': server_time
         }))
         
+    def send_input_ack(self, client_time, dispatched: float):
+        """Tell the page when its input reached the device, it then waits for the first
+        frame captured after that to measure input-to-screen latency."""
+        message = json.dumps({
+            'a': 'input',
+            'ct': client_time,
+            'st': int(dispatched * 1000)
+        })
+        # gestures are injected from the mouse event thread
+        self.io_loop.add_callback(self._write_if_open, message)
+
+    def _write_if_open(self, message):
+        if self.ws_connection is not None:
+            self.write_message(message)
+
     def on_mouse_event(self):
-        screen_width, screen_height = self.DEVICE.display_size
+        screen_width, screen_height = self.device.display_size
         screen_size = {
             'w': screen_width,
             'h': screen_height
@@ -136,11 +741,11 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
         last_event_time = 0
         self.LAST_GESTURE = None
         while not self.stop_event.is_set():
-            if self.EVETS_QUEUE.empty():
+            if self.session.events.empty():
                 time.sleep(0.01)
                 continue
             
-            event = self.EVETS_QUEUE.get(timeout=0.01)
+            event = self.session.events.get(timeout=0.01)
             if event is not None:
                 action = event.get('action')
                 timestamp = event.get('timestamp')
@@ -150,8 +755,10 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
                         logger.info(f"get mouse event {action} {timestamp} {data}")
                         last_event_time = 0
                         if self.LAST_GESTURE is not None:
+                            dispatched = time.time()
                             self.LAST_GESTURE.action()
                             self.LAST_GESTURE = None
+                            self.send_input_ack(timestamp, dispatched)
                         else:
                             logger.info(f"no gesture")
                     else:
@@ -163,9 +770,9 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
                         last_event_time = timestamp
                         if action == 'down' or self.LAST_GESTURE is None: 
                             try:
-                                self.LAST_GESTURE = self.DEVICE.gesture.start(x, y, 0.1)
+                                self.LAST_GESTURE = self.device.gesture.start(x, y, 0.1)
                             except InjectGestureError as e:
-                                self.LAST_GESTURE = self.DEVICE.gesture
+                                self.LAST_GESTURE = self.device.gesture
                         elif action == 'move':
                             self.LAST_GESTURE.move(x, y, timediff)
                         elif action == 'hover':
@@ -175,7 +782,7 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
                     logger.exception(e)
         
     def add_mouse_event(self, action, timestamp, data = None):
-        self.EVETS_QUEUE.put_nowait({
+        self.session.events.put_nowait({
             'action': action,
             'timestamp': timestamp,
             'data': data
@@ -202,33 +809,407 @@ class MiniTouchWSHandler(CorsMixin, WebSocketHandler):
         return x_scaled, y_scaled
 
 
+class StatsHandler(CorsMixin, DeviceSessionMixin, tornado.web.RequestHandler):
+
+    async def get(self, serial: str = None):
+        await self.find_session()
+        session = self.session
+        broadcasters = {b.name: b.stats() for b in session.broadcasters.values()}
+        streams = [stream.stats() for stream in session.streams]
+        capture = session.device.capture_stats() if session.device is not None else {}
+        self.write(dict(capture, session=session.stats(), viewers=session.viewer_stats,
+                        broadcasters=broadcasters, streams=streams))
+
+
+class HealthHandler(CorsMixin, DeviceSessionMixin, tornado.web.RequestHandler):
+    """State of the device of a --shard worker, does not start the device."""
+
+    async def get(self):
+        await self.find_session()
+        self.write(dict(self.session.stats(), serial=self.session.serial, pid=os.getpid()))
+
+
+def make_app(debug: bool = True, health: bool = False) -> tornado.web.Application:
+    routes = [
+        (r"/", MainHandler),
+        (r"/devices", DevicesHandler),
+        (r"/minitouch", MiniTouchWSHandler),
+        (r"/mjpeg", MJPEGHandler),
+        (r"/stream", FrameStreamHandler),
+        (r"/stats", StatsHandler),
+        (r"/d/([^/]+)/", MainHandler),
+        (r"/d/([^/]+)/minitouch", MiniTouchWSHandler),
+        (r"/d/([^/]+)/mjpeg", MJPEGHandler),
+        (r"/d/([^/]+)/stream", FrameStreamHandler),
+        (r"/d/([^/]+)/stats", StatsHandler),
+    ]
+    if health:
+        routes.append((r"/health", HealthHandler))
+    return tornado.web.Application(routes, debug=debug, template_path=TEMPLATE_PATH)
+
+
+def serve_device(serial: str, socket_path: str, linger: float, options: dict):
+    """Worker process of --shard: serve one device on a Unix socket."""
+    enable_pretty_logging()
+    DeviceSessionMixin.REGISTRY = DeviceRegistry([serial], discover=False, linger=linger, **options)
+    # the front-end passes the viewer address in X-Real-IP
+    server = tornado.httpserver.HTTPServer(make_app(debug=False, health=True), xheaders=True)
+    server.add_socket(tornado.netutil.bind_unix_socket(socket_path))
+    logger.info(f"worker {os.getpid()} serving {serial} on {socket_path}")
+    # exit with the front-end, even if it was killed
+    parent = os.getppid()
+    tornado.ioloop.PeriodicCallback(lambda: os.getppid() != parent and os._exit(0), 1000).start()
+    tornado.ioloop.IOLoop.current().start()
+
+
+class DeviceWorker:
+    """A --shard worker process serving one device, restarted when unhealthy."""
+
+    def __init__(self, serial: str, socket_path: str, linger: float, options: dict):
+        self.serial = serial
+        self.socket_path = socket_path
+        self.linger = linger
+        self.options = options
+        self.process: multiprocessing.Process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.restarting = False
+        self.health: dict = {}
+        self.error: str = None
+
+    @property
+    def state(self) -> str:
+        if self.process is None or not self.process.is_alive():
+            return "down"
+        if self.failures:
+            return "unhealthy"
+        return self.health.get("state", "starting")
+
+    @property
+    def connections(self) -> int:
+        return self.health.get("connections", 0)
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        # spawn: the parent runs an event loop and threads that a fork would copy
+        self.process = _SPAWN.Process(target=serve_device, name=f"device-{self.serial}",
+                                      args=(self.serial, self.socket_path, self.linger, self.options))
+        self.process.start()
+        self.started = time.monotonic()
+        self.failures = 0
+        self.health = {}
+        logger.info(f"started worker {self.process.pid} for {self.serial}")
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker, blocking; use `stop_async` on the IOLoop."""
+        if self.process is None:
+            return
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process = None
+
+    async def stop_async(self, timeout: float = 5.0):
+        """Stop the worker without blocking the front-end serving the other devices."""
+        process, self.process = self.process, None
+        if process is None:
+            return
+        process.terminate()
+        deadline = time.monotonic() + timeout
+        while process.exitcode is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if process.exitcode is None:
+            process.kill()
+            while process.exitcode is None:
+                await asyncio.sleep(0.05)
+        process.join()
+
+    async def restart(self):
+        logger.warning(f"restarting worker of {self.serial}: {self.error}")
+        await self.stop_async()
+        self.restarts += 1
+        self.start()
+
+    async def connect(self) -> IOStream:
+        stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+        await stream.connect(self.socket_path)
+        return stream
+
+    async def check(self, timeout: float) -> bool:
+        """GET /health from the worker, False if it is dead or does not answer in time."""
+        if self.process is None or not self.process.is_alive():
+            self.error = f"exited with {self.process.exitcode if self.process else None}"
+            return False
+        stream = None
+        try:
+            stream = await tornado.gen.with_timeout(timedelta(seconds=timeout), self.connect())
+            await stream.write(b"GET /health HTTP/1.0\r\nHost: worker\r\n\r\n")
+            response = await tornado.gen.with_timeout(timedelta(seconds=timeout), stream.read_until_close())
+            head, _, body = response.partition(b"\r\n\r\n")
+            if b" 200 " not in head.split(b"\r\n", 1)[0]:
+                raise IOError(head.split(b"\r\n", 1)[0].decode(errors="replace"))
+            self.health = json.loads(body)
+            self.error = None
+            return True
+        except Exception as e:
+            self.error = str(e) or e.__class__.__name__
+            return False
+        finally:
+            if stream is not None:
+                stream.close()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "pid": self.process.pid if self.process else None,
+            "restarts": self.restarts,
+            "error": self.error,
+            "health": self.health,
+        }
+
+
+class ShardSupervisor:
+    """Run every device in its own DeviceWorker process and keep them healthy.
+
+    Each worker runs the HmDevice, CapObserver, decode pool and Tornado
+    handlers of one device with its own GIL, so devices scale with cores.
+    Workers are health checked every `check_interval` seconds and restarted
+    when they exit or miss `max_failures` checks in a row; a worker still
+    starting gets `startup_grace` seconds.
+    """
+
+    def __init__(self, serials: list = (), discover: bool = True, linger: float = 5.0,
+                 check_interval: float = 5.0, check_timeout: float = 3.0, max_failures: int = 3,
+                 startup_grace: float = 15.0, **options):
+        self.default = serials[0] if serials else None
+        self.discover = discover
+        self.linger = linger
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.max_failures = max_failures
+        self.startup_grace = startup_grace
+        self.options = options
+        self.socket_dir = tempfile.mkdtemp(prefix="scrcpy-shard-")
+        self.workers: typing.Dict[str, DeviceWorker] = {}
+        self._checker: tornado.ioloop.PeriodicCallback = None
+        for serial in serials:
+            self._add(serial)
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+        self._checker = tornado.ioloop.PeriodicCallback(self.check, self.check_interval * 1000)
+        self._checker.start()
+
+    def stop(self):
+        if self._checker is not None:
+            self._checker.stop()
+        for worker in self.workers.values():
+            worker.stop()
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+
+    async def refresh(self):
+        """Start workers for newly connected devices."""
+        if not self.discover:
+            return
+        try:
+            targets = await tornado.ioloop.IOLoop.current().run_in_executor(None, list_targets)
+        except Exception as e:
+            logger.warning(f"device discovery failed: {e}")
+            return
+        for serial in targets:
+            if serial not in self.workers:
+                logger.info(f"found device {serial}")
+                self._add(serial).start()
+
+    async def get(self, serial: str = None) -> typing.Optional[DeviceWorker]:
+        serial = serial or self.default
+        if serial is not None and serial not in self.workers:
+            await self.refresh()
+        return self.workers.get(serial)
+
+    async def check(self):
+        # a hung worker must not delay the checks of the others
+        await asyncio.gather(*(self._check(worker) for worker in list(self.workers.values())))
+
+    async def _check(self, worker: DeviceWorker):
+        if worker.restarting:
+            return
+        if await worker.check(self.check_timeout):
+            worker.failures = 0
+            return
+        alive = worker.process is not None and worker.process.is_alive()
+        if alive and time.monotonic() - worker.started < self.startup_grace:
+            return
+        worker.failures += 1
+        logger.warning(f"worker of {worker.serial} failed health check {worker.failures}: {worker.error}")
+        if not alive or worker.failures >= self.max_failures:
+            worker.restarting = True
+            try:
+                await worker.restart()
+            finally:
+                worker.restarting = False
+
+    def _add(self, serial: str) -> DeviceWorker:
+        options = dict(self.options)
+        if serial != self.default:
+            options.pop("record_stream", None)
+        socket_path = os.path.join(self.socket_dir, f"{len(self.workers)}.sock")
+        self.workers[serial] = DeviceWorker(serial, socket_path, self.linger, options)
+        return self.workers[serial]
+
+
+class ShardRouter(tornado.tcpserver.TCPServer):
+    """Front-end of --shard, hands each connection to the worker of its device.
+
+    Only the request line is parsed: /d/<serial>/... goes to the worker of
+    that device, the other routes to the first --serial device, /devices
+    is answered here. Everything after the request head, MJPEG parts and
+    WebSocket frames alike, is relayed as bytes between the two sockets,
+    one chunk at a time, so a slow viewer still applies backpressure to its
+    worker and the front-end does no per-frame work.
+    """
+
+    def __init__(self, supervisor: ShardSupervisor):
+        super().__init__()
+        self.supervisor = supervisor
+        self.templates = tornado.template.Loader(TEMPLATE_PATH)
+
+    async def handle_stream(self, stream: IOStream, address):
+        try:
+            head = await stream.read_until(b"\r\n\r\n", max_bytes=64 * 1024)
+        except StreamClosedError:
+            return
+        except UnsatisfiableReadError:
+            await self._respond(stream, "431 Request Header Fields Too Large", b"request head too large")
+            return
+        request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+        parts = request_line.split(" ")
+        path = urllib.parse.urlsplit(parts[1]).path if len(parts) == 3 else ""
+        match = re.match(r"/d/([^/]+)/", path)
+        serial = tornado.escape.url_unescape(match.group(1)) if match else None
+
+        if path == "/devices" or (path == "/" and self.supervisor.default is None):
+            await self._devices(stream, parts[1] if len(parts) == 3 else "")
+            return
+        worker = await self.supervisor.get(serial)
+        if worker is None:
+            await self._respond(stream, "404 Not Found", f"unknown device {serial}".encode())
+            return
+        try:
+            upstream = await worker.connect()
+        except Exception as e:
+            await self._respond(stream, "503 Service Unavailable",
+                                f"device {worker.serial} is unavailable: {e}".encode())
+            return
+        # the worker serves over a Unix socket, tell it who the viewer is
+        ip = address[0] if isinstance(address, tuple) else ""
+        head = head[:-2] + f"X-Real-IP: {ip}\r\n\r\n".encode()
+        await upstream.write(head)
+        await tornado.gen.multi([self._relay(stream, upstream), self._relay(upstream, stream)])
+
+    @staticmethod
+    async def _relay(source: IOStream, destination: IOStream):
+        try:
+            while True:
+                chunk = await source.read_bytes(64 * 1024, partial=True)
+                # read the next chunk only once this one is written
+                await destination.write(chunk)
+        except StreamClosedError:
+            pass
+        finally:
+            source.close()
+            destination.close()
+
+    async def _devices(self, stream: IOStream, target: str):
+        await self.supervisor.refresh()
+        workers = sorted(self.supervisor.workers.values(), key=lambda worker: worker.serial)
+        if "format=json" in target:
+            body = json.dumps({worker.serial: worker.stats() for worker in workers}).encode()
+            await self._respond(stream, "200 OK", body, "application/json")
+        else:
+            body = self.templates.load("devices.html").generate(sessions=workers,
+                                                                 url_escape=tornado.escape.url_escape)
+            await self._respond(stream, "200 OK", body, "text/html; charset=UTF-8")
+
+    @staticmethod
+    async def _respond(stream: IOStream, status: str, body: bytes, content_type: str = "text/plain"):
+        try:
+            await stream.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                               f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        except StreamClosedError:
+            pass
+        stream.close()
+
+
 def start():
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", 
                         "--serial",
-                        required=True,
-                        help="device serial number")
+                        action="append",
+                        default=[],
+                        help="device serial number, repeat for more devices; the first one is also "
+                             "served on /mjpeg, /minitouch, ... (default: every device of hdc list targets)")
     parser.add_argument("-p",
                         "--port",
                         type=int,
                         default=18080,
                         help="listen port")
+    parser.add_argument("--passthrough",
+                        action="store_true",
+                        help="stream the device JPEG frames without transcoding")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="frame decode processes per device")
+    parser.add_argument("--record-stream",
+                        default=None,
+                        help="save the raw capture stream of the first --serial device to this file "
+                             "for benchmarks/bench_replay.py")
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="send per-stage capture timestamps with every frame, see /stats")
+    parser.add_argument("--no-discover",
+                        action="store_true",
+                        help="serve only the --serial devices")
+    parser.add_argument("--linger",
+                        type=float,
+                        default=5.0,
+                        help="seconds a device keeps capturing after its last viewer left")
+    parser.add_argument("--shard",
+                        action="store_true",
+                        help="run every device in its own worker process behind this front-end")
 
     args = parser.parse_args()
-        
-    dev = HmDevice(args.serial)
-    MJPEGHandler.CAP_READER = dev.cap_reader
-    MiniTouchWSHandler.DEVICE = dev
+    enable_pretty_logging()
 
+    if args.shard:
+        supervisor = ShardSupervisor(args.serial, discover=not args.no_discover, linger=args.linger,
+                                     passthrough=args.passthrough, workers=args.workers,
+                                     profile=args.profile, record_stream=args.record_stream)
+        ShardRouter(supervisor).listen(args.port)
+        # leave through the finally below, which stops the workers
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        supervisor.start()
+        tornado.ioloop.IOLoop.current().add_callback(supervisor.refresh)
+        try:
+            tornado.ioloop.IOLoop.current().start()
+        finally:
+            supervisor.stop()
+        return
 
-    app = tornado.web.Application([
-        (r"/", MainHandler),
-        (r"/minitouch", MiniTouchWSHandler),
-        (r"/mjpeg", MJPEGHandler),
-    ], debug=True, template_path=os.path.join(os.path.dirname(__file__), "templates"))
-    app.listen(args.port)
+    DeviceSessionMixin.REGISTRY = registry = DeviceRegistry(
+        args.serial, discover=not args.no_discover, linger=args.linger,
+        passthrough=args.passthrough, workers=args.workers, profile=args.profile)
+    if args.record_stream and registry.default:
+        registry.sessions[registry.default].options["record_stream"] = args.record_stream
 
-    enable_pretty_logging()
+    make_app().listen(args.port)
+    tornado.ioloop.IOLoop.current().add_callback(registry.refresh)
     tornado.ioloop.IOLoop.current().start()
     
 if __name__ == "__main__":